@@ -0,0 +1,148 @@
+"""
+Benchmark for turning screen grabs into PIL images.
+
+Compares the old conversion (copying the grab to bytes, then
+Image.frombytes) with screenshot_utils.frame_to_image, which crops and
+downscales the raw BGRA buffer before Pillow sees it. Synthetic frames are
+used so results don't depend on the attached monitors; each case runs in a
+fresh process so its peak memory can be measured.
+
+Usage:
+    python benchmark_capture.py [--frames N] [--live]
+
+--live also times real grabs of the selected monitor.
+"""
+
+import argparse
+import ctypes
+import multiprocessing
+import sys
+import time
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4K": (3840, 2160),
+}
+
+CASES = [
+    "frombytes (old)",
+    "old + downscale to 1280",
+    "frame_to_image",
+    "frame_to_image, max_edge=1280",
+    "frame_to_image, max_edge=960",
+    "frame_to_image, left half",
+]
+
+
+def _peak_rss():
+    """Peak resident memory of this process in bytes."""
+    if sys.platform == "win32":
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize",
+                    "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage",
+                )
+            ]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        )
+        return counters.PeakWorkingSetSize
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _convert(case, shot):
+    from PIL import Image
+    import screenshot_utils
+
+    width, height = shot.size
+    if case == "frombytes (old)":
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+    if case == "old + downscale to 1280":
+        img = Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+        return screenshot_utils._downscale(img, 1280)
+    if case == "frame_to_image":
+        return screenshot_utils.frame_to_image(shot)
+    if case == "frame_to_image, max_edge=1280":
+        return screenshot_utils.frame_to_image(shot, max_edge=1280)
+    if case == "frame_to_image, max_edge=960":
+        return screenshot_utils.frame_to_image(shot, max_edge=960)
+    if case == "frame_to_image, left half":
+        return screenshot_utils.frame_to_image(shot, crop=(0, 0, width // 2, height))
+    raise ValueError(case)
+
+
+def _run_case(case, width, height, frames, results):
+    """Child process: measure the peak memory of one conversion, then its speed."""
+    import numpy as np
+    from mss.screenshot import ScreenShot
+
+    # Fill the frame in place so building it doesn't raise the peak
+    shot = ScreenShot.from_size(bytearray(width * height * 4), width, height)
+    pixels = np.frombuffer(shot.raw, dtype=np.uint8).reshape(height, width, 4)
+    pixels[..., 0] = np.arange(width, dtype=np.uint8)
+    pixels[..., 1] = np.arange(height, dtype=np.uint8)[:, None]
+    pixels[..., 2] = 128
+    del pixels
+
+    baseline = _peak_rss()
+    img = _convert(case, shot)
+    peak = _peak_rss() - baseline
+    del img
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        _convert(case, shot)
+    results.put(((time.perf_counter() - start) / frames * 1000, peak / 2**20))
+
+
+def _live(frames):
+    import settings_manager
+    import screenshot_utils
+
+    monitor_index = settings_manager.get_selected_monitor()
+    sct_img = screenshot_utils.get_engine().grab(monitor_index)  # open the handle first
+    print(f"\nLive grabs of monitor {monitor_index} ({sct_img.width}x{sct_img.height}):")
+    start = time.perf_counter()
+    for _ in range(frames):
+        sct_img = screenshot_utils.get_engine().grab(monitor_index)
+    grab_ms = (time.perf_counter() - start) / frames * 1000
+    start = time.perf_counter()
+    for _ in range(frames):
+        screenshot_utils.capture_screen(monitor_index)
+    capture_ms = (time.perf_counter() - start) / frames * 1000
+    print(f"  grab only:      {grab_ms:7.1f} ms/frame")
+    print(f"  capture_screen: {capture_ms:7.1f} ms/frame")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark screen grab conversion.")
+    parser.add_argument("--frames", type=int, default=20, help="frames timed per case")
+    parser.add_argument("--live", action="store_true", help="also time real grabs")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'resolution':<11}{'case':<32}{'ms/frame':>10}{'peak MB':>10}")
+    for label, (width, height) in RESOLUTIONS.items():
+        for case in CASES:
+            results = context.Queue()
+            process = context.Process(target=_run_case, args=(case, width, height, args.frames, results))
+            process.start()
+            ms, peak = results.get()
+            process.join()
+            print(f"{label:<11}{case:<32}{ms:>10.1f}{peak:>10.1f}")
+
+    if args.live:
+        _live(args.frames)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
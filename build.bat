@@ -92,6 +92,7 @@ pyinstaller --noconfirm --onedir --windowed ^
     --hidden-import "tiktoken_ext" ^
     --hidden-import "tiktoken_ext.openai_public" ^
     --hidden-import "edge_tts" ^
+    --hidden-import "aiohttp" ^
     --hidden-import "pygame" ^
     --collect-all "customtkinter" ^
     --collect-all "whisper" ^
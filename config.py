@@ -11,3 +11,22 @@ HOTKEY = "ctrl+shift+alt"
 WINDOW_WIDTH = 560
 WINDOW_HEIGHT_INITIAL = 110
 WINDOW_HEIGHT_EXPANDED = 450
+
+# Number of sessions listed per page in the History window
+HISTORY_PAGE_SIZE = 50
+
+# Conversation turns loaded at a time when opening a session (scroll up for more)
+CHAT_PAGE_TURNS = 20
+
+# How often (ms) the UI checks an in-flight query for streamed text and its result
+QUERY_POLL_INTERVAL = 50
+
+# How often (ms) the UI refreshes the offline queue status
+QUEUE_STATUS_INTERVAL = 1000
+
+# A screenshot taken when the overlay opens is used for the first query if it
+# is sent within this many seconds; otherwise the screen is captured again
+PRECAPTURE_MAX_AGE = 120
+
+# Long edge (pixels) of the thumbnail sent when the screen hasn't changed
+UNCHANGED_THUMBNAIL_EDGE = 960
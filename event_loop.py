@@ -0,0 +1,46 @@
+"""
+Shared asyncio event loop running on one background thread.
+
+Async work (webhook queries, Edge TTS synthesis) is scheduled here instead
+of each task starting its own thread or event loop. Other threads submit
+coroutines and get a concurrent.futures.Future back, which the Tk thread
+can poll with done() and cancel with cancel().
+"""
+
+import asyncio
+import threading
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+def _run(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    """Return the shared loop, starting its thread on first use."""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_run, args=(_loop,), name="event-loop", daemon=True)
+            _thread.start()
+        return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop. Returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop and wait for its result (not from the loop thread)."""
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
@@ -0,0 +1,232 @@
+"""
+History retention and compressed archival.
+
+Sessions that fall outside the retention policy are moved out of the live
+session store into gzip files under ARCHIVE_DIR. Archived sessions can
+still be searched and restored.
+
+Usage:
+    python history_archive.py retention     Apply the retention settings now
+    python history_archive.py compact       Reclaim space in the live store
+    python history_archive.py list          List archived sessions
+    python history_archive.py search TEXT   Search archived sessions
+    python history_archive.py restore ID    Move a session back to the live store
+"""
+
+import gzip
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import session_store
+
+ARCHIVE_DIR = "history_archive"
+INDEX_FILE = os.path.join(ARCHIVE_DIR, "index.json")
+
+_lock = threading.Lock()
+
+
+def _archive_path(session_id):
+    return os.path.join(ARCHIVE_DIR, f"{session_id}.json.gz")
+
+
+def _load_index():
+    try:
+        with open(INDEX_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error loading archive index: {e}")
+        return {}
+
+
+def _save_index(index):
+    tmp_path = INDEX_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, INDEX_FILE)
+
+
+def archive_session(session_id):
+    """Move a session from the live store into a gzip archive file."""
+    session = session_store.get_session(session_id)
+    if session is None:
+        return False
+
+    with _lock:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = _archive_path(session_id)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, path)
+
+        index = _load_index()
+        index[session_id] = {
+            "id": session_id,
+            "title": session["title"],
+            "timestamp": session["timestamp"],
+            "message_count": len(session["messages"]),
+            "archived_at": time.time()
+        }
+        _save_index(index)
+
+    # Only drop the live copy once the archive is safely on disk
+    session_store.delete_session(session_id)
+    return True
+
+
+def _read_archived(session_id):
+    with gzip.open(_archive_path(session_id), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def restore_session(session_id):
+    """Move an archived session back into the live store."""
+    with _lock:
+        index = _load_index()
+        if session_id not in index:
+            return False
+        session = _read_archived(session_id)
+        # Restored sessions count as recent; with the old timestamp the next
+        # retention pass would archive them again straight away
+        session["timestamp"] = time.time()
+        session_store.restore_session(session_id, session)
+        del index[session_id]
+        _save_index(index)
+        os.remove(_archive_path(session_id))
+    return True
+
+
+def list_archived():
+    """Return archived session summaries, newest first."""
+    with _lock:
+        sessions = list(_load_index().values())
+    sessions.sort(key=lambda x: x.get("timestamp", 0), reverse=True)
+    return sessions
+
+
+def search_archive(text, limit=session_store.SEARCH_LIMIT):
+    """
+    Search archived sessions for messages containing every word of text
+    ("quoted phrases" must match exactly). This decompresses each archive,
+    so it is meant for explicit searches rather than search-as-you-type.
+    """
+    terms = [p or w for p, w in re.findall(r'"([^"]*)"|(\S+)', text.lower())]
+    terms = [t.strip("*") for t in terms if t.strip("*")]
+    if not terms:
+        return []
+
+    results = []
+    for summary in list_archived():
+        try:
+            session = _read_archived(summary["id"])
+        except Exception as e:
+            print(f"Error reading archived session {summary['id']}: {e}")
+            continue
+        for msg in session.get("messages", []):
+            content = msg.get("content", "")
+            lowered = content.lower()
+            if all(t in lowered for t in terms):
+                start = max(0, lowered.find(terms[0]) - 40)
+                results.append({
+                    "session_id": summary["id"],
+                    "title": summary["title"],
+                    "timestamp": summary["timestamp"],
+                    "role": msg.get("role", "user"),
+                    "snippet": content[start:start + 120],
+                    "archived": True
+                })
+                if len(results) >= limit:
+                    return results
+    return results
+
+
+def select_for_retention(sizes, max_age_days=0, max_sessions=0, max_bytes=0, now=None):
+    """
+    Pick sessions to archive. sizes is [(id, timestamp, bytes), ...] newest
+    first (see session_store.session_sizes). A limit of 0 disables it.
+    """
+    now = now or time.time()
+    cutoff = now - max_age_days * 86400 if max_age_days else None
+    selected = []
+    kept = 0
+    kept_bytes = 0
+    for session_id, timestamp, size in sizes:
+        if ((cutoff is not None and timestamp < cutoff)
+                or (max_sessions and kept >= max_sessions)
+                or (max_bytes and kept_bytes + size > max_bytes)):
+            selected.append(session_id)
+        else:
+            kept += 1
+            kept_bytes += size
+    return selected
+
+
+def apply_retention(max_age_days=0, max_sessions=0, max_bytes=0):
+    """Archive every live session that falls outside the retention limits."""
+    if not (max_age_days or max_sessions or max_bytes):
+        return 0
+    selected = select_for_retention(
+        session_store.session_sizes(), max_age_days, max_sessions, max_bytes
+    )
+    archived = 0
+    for session_id in selected:
+        try:
+            if archive_session(session_id):
+                archived += 1
+        except Exception as e:
+            print(f"Error archiving session {session_id}: {e}")
+    return archived
+
+
+def compact():
+    """Reclaim space in the live store and drop stray archive files."""
+    session_store.compact()
+    with _lock:
+        if not os.path.isdir(ARCHIVE_DIR):
+            return
+        index = _load_index()
+        for name in os.listdir(ARCHIVE_DIR):
+            if name.endswith(".tmp") or (
+                name.endswith(".json.gz") and name[:-len(".json.gz")] not in index
+            ):
+                os.remove(os.path.join(ARCHIVE_DIR, name))
+
+
+def main(argv):
+    import settings_manager
+
+    if not argv:
+        print(__doc__)
+        return 1
+
+    command, args = argv[0], argv[1:]
+    if command == "retention":
+        print(f"Archived {settings_manager.apply_history_retention()} session(s).")
+    elif command == "compact":
+        size_before = os.path.getsize(session_store.DB_FILE)
+        compact()
+        print(f"Compacted {session_store.DB_FILE}: {size_before} -> "
+              f"{os.path.getsize(session_store.DB_FILE)} bytes")
+    elif command == "list":
+        for s in list_archived():
+            print(f"{s['id']}  {time.strftime('%Y-%m-%d', time.localtime(s['timestamp']))}  {s['title']}")
+    elif command == "search" and args:
+        for r in search_archive(" ".join(args)):
+            print(f"{r['session_id']}  {r['title']}\n    {r['role']}: {r['snippet']}")
+    elif command == "restore" and args:
+        for session_id in args:
+            print(f"{session_id}: {'restored' if restore_session(session_id) else 'not found'}")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,170 @@
+"""
+Write-ahead journal for chat interactions.
+
+A query is appended (and fsynced) to the journal as soon as it is submitted,
+and its response when it arrives. Completed interactions are then copied
+into session_store in batches by a background thread. If the app dies with
+a query in flight, recover() finds it on the next start and saves it with
+an "interrupted" marker instead of losing it.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+
+import session_store
+
+JOURNAL_FILE = "interactions.journal"
+
+# Completed interactions are written to the session store this often (seconds)
+APPLY_INTERVAL = 1.0
+
+INTERRUPTED_RESPONSE = "[No response: the app closed before the answer arrived]"
+
+_lock = threading.RLock()
+_pending = {}  # entry id -> {"session_id", "query", "ts"} still waiting for a response
+_completed = []  # entries with responses, not yet in the session store
+_apply_event = threading.Event()
+_applier_thread = None
+
+
+def _append(record):
+    """Append one record to the journal and make it durable."""
+    with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def record_query(session_id, query):
+    """Journal a submitted query. Returns the entry id for record_response."""
+    entry_id = str(uuid.uuid4())
+    entry = {"session_id": session_id, "query": query, "ts": time.time()}
+    with _lock:
+        _pending[entry_id] = entry
+        try:
+            _append({"op": "query", "id": entry_id, **entry})
+        except Exception as e:
+            print(f"Error writing interaction journal: {e}")
+    return entry_id
+
+
+def record_response(entry_id, response):
+    """Journal the response for a query and schedule it for the session store."""
+    global _applier_thread
+    with _lock:
+        entry = _pending.pop(entry_id, None)
+        if entry is None:
+            return
+        try:
+            _append({"op": "response", "id": entry_id, "response": response})
+        except Exception as e:
+            print(f"Error writing interaction journal: {e}")
+        _completed.append({"id": entry_id, "response": response, **entry})
+
+        if _applier_thread is None:
+            _applier_thread = threading.Thread(target=_applier_loop, daemon=True)
+            _applier_thread.start()
+    _apply_event.set()
+
+
+def discard(entry_id):
+    """Forget a query that will never get a response (e.g. it raised)."""
+    with _lock:
+        if _pending.pop(entry_id, None) is not None:
+            try:
+                _append({"op": "discard", "id": entry_id})
+            except Exception as e:
+                print(f"Error writing interaction journal: {e}")
+
+
+def _applier_loop():
+    while True:
+        _apply_event.wait()
+        # Let a few responses accumulate so they go in as one transaction
+        time.sleep(APPLY_INTERVAL)
+        _apply_event.clear()
+        apply()
+
+
+def apply():
+    """Write completed interactions to the session store and shrink the journal."""
+    if not _completed:
+        return
+    with _lock:
+        if not _completed:
+            return
+        batch = list(_completed)
+        try:
+            session_store.append_interactions(batch)
+        except Exception as e:
+            print(f"Error applying interaction journal: {e}")
+            return
+        del _completed[:len(batch)]
+        _rewrite()
+
+
+def _rewrite():
+    """Rewrite the journal so it only holds queries still in flight."""
+    try:
+        if not _pending:
+            if os.path.exists(JOURNAL_FILE):
+                os.remove(JOURNAL_FILE)
+        else:
+            tmp_path = JOURNAL_FILE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry_id, entry in _pending.items():
+                    f.write(json.dumps({"op": "query", "id": entry_id, **entry}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, JOURNAL_FILE)
+        session_store.clear_applied_entries()
+    except Exception as e:
+        print(f"Error compacting interaction journal: {e}")
+
+
+def recover():
+    """
+    Replay the journal left by a previous run. Completed interactions are
+    saved normally; queries that never got a response are saved with an
+    interrupted marker. Returns the number of interactions recovered.
+    """
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+
+    entries = {}
+    with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-append
+                continue
+            op = record.get("op")
+            if op == "query":
+                entries[record["id"]] = record
+            elif op == "response" and record["id"] in entries:
+                entries[record["id"]]["response"] = record["response"]
+            elif op == "discard":
+                entries.pop(record["id"], None)
+
+    batch = [
+        {
+            "id": entry_id,
+            "session_id": record["session_id"],
+            "query": record["query"],
+            "response": record.get("response", INTERRUPTED_RESPONSE)
+        }
+        for entry_id, record in entries.items()
+    ]
+    with _lock:
+        if batch:
+            session_store.append_interactions(batch)
+        _rewrite()
+    return len(batch)
+
+
+atexit.register(apply)
@@ -1,9 +1,19 @@
 import keyboard
+import threading
 import config
 import settings_manager
+import offline_queue
 from overlay_app import OverlayApp
 
 def main():
+    # Save anything a previous run left in the interaction journal
+    recovered = settings_manager.recover_interactions()
+    if recovered:
+        print(f"Recovered {recovered} interaction(s) from the journal.")
+
+    # Resend queries left in the offline queue by a previous run
+    offline_queue.start()
+
     # Load initial hotkey
     current_hotkey = settings_manager.get_hotkey()
 
@@ -23,6 +33,9 @@ def main():
 
     app = OverlayApp(update_hotkey_callback=update_hotkey)
 
+    # Archive old sessions in the background so startup isn't delayed
+    threading.Thread(target=settings_manager.apply_history_retention, daemon=True).start()
+
     def toggle_overlay():
         if app.is_visible:
             # Schedule hide on main thread
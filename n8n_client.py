@@ -1,26 +1,218 @@
-import requests
+import asyncio
+import atexit
+import concurrent.futures
+import json
+import random
+import threading
+import time
+import uuid
+import aiohttp
 import config
+import event_loop
+import response_cache
 import settings_manager
 
-def send_query(text, image_bytes, complexity="Mid", session_id=None, tts_enabled=False):
+
+class QueryCancelled(Exception):
+    """Raised by send_query when the query was cancelled."""
+
+
+class QueryError(Exception):
+    """A failed query; the message is shown to the user after "Error: "."""
+
+
+class WebhookConnectionError(QueryError):
+    """The webhook could not be reached (retried, and queued when offline)."""
+
+
+class WebhookTimeout(QueryError):
+    """The webhook took too long to take the query or to answer."""
+
+
+class ConnectTimeout(WebhookConnectionError, WebhookTimeout):
+    """No connection within the connect timeout; safe to retry."""
+
+
+class HTTPStatusError(QueryError):
+    """The webhook answered with an HTTP error status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(WebhookConnectionError):
+    """Raised without contacting the webhook while the circuit breaker is open."""
+
+
+class _UploadTimeout(Exception):
+    pass
+
+
+class ErrorResponse(str):
     """
-    Sends the text query and image to the n8n webhook.
+    The "Error: ..." text returned for a failed query. offline is True when
+    the webhook could not be reached (or was unavailable) and nothing of the
+    answer arrived, so the query can be queued and sent again later.
+    """
+    offline = False
 
-    Args:
-        text (str): The user's question.
-        image_bytes (bytes): The screenshot image data.
-        complexity (str): The complexity level (Low, Mid, High).
-        session_id (str): The session ID for context.
-        tts_enabled (bool): Whether TTS is enabled (affects response format).
 
-    Returns:
-        str: The response text from the webhook.
+# Retry policy for failures where the webhook never got (or refused) the
+# query: connection errors and the HTTP statuses below. Delays grow
+# exponentially with full jitter.
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# After this many consecutive connection failures the breaker opens and
+# queries fail fast until CIRCUIT_RESET_TIMEOUT has passed; then a single
+# trial query is let through to probe the endpoint.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+
+class CircuitBreaker:
+    """Fails fast while the webhook is down instead of waiting on every query."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if calls should not be attempted right now.
+        Returns True if this call is the half-open trial.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(
+                    f"The webhook appears to be down; trying again in {max(remaining, 1):.0f}s"
+                )
+            # Half-open: let one trial call through
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a trial call that finished without a verdict (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+
+_breaker = CircuitBreaker()
+
+
+class QueryHandle:
     """
-    url = settings_manager.get_webhook_url()
+    Lets another thread (e.g. the UI) abort an in-flight query. cancel()
+    cancels the query's future, which closes its connection on the event
+    loop straight away, even in the middle of an upload.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._future = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            future = self._future
+        if future is not None:
+            future.cancel()
+
+    def _attach_future(self, future):
+        with self._lock:
+            self._future = future
+            cancelled = self._cancelled
+        if cancelled:
+            future.cancel()
+
+
+# Long-lived aiohttp session so queries reuse pooled keep-alive connections
+# instead of paying DNS + TCP + TLS setup every time. Rebuilt whenever the
+# webhook URL or pool size changes. Only used on the shared event loop.
+_session = None
+_session_key = None
+
+async def _get_session():
+    """Return the shared HTTP session for the current webhook URL."""
+    global _session, _session_key
+    key = (settings_manager.get_webhook_url(), settings_manager.get_http_pool_size())
+    if _session is None or _session_key != key:
+        old = _session
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=key[1]), trust_env=True
+        )
+        _session_key = key
+        # A new endpoint starts with a clean failure history
+        _breaker.reset()
+        if old is not None:
+            await old.close()
+    return _session
+
+def _close_session():
+    if _session is not None:
+        try:
+            event_loop.run(_session.close(), timeout=1)
+        except Exception:
+            pass
+
+atexit.register(_close_session)
+
+def _image_part(image_bytes):
+    """Multipart (filename, bytes, MIME type) for a screenshot; plain bytes are PNG."""
+    return (getattr(image_bytes, "filename", "screenshot.png"), image_bytes,
+            getattr(image_bytes, "mime_type", "image/png"))
 
+def _build_payload(text, image_bytes, complexity, session_id, tts_enabled,
+                   screenshot_handle=None, race_preview=False):
+    """
+    Build the multipart form fields and files for a webhook query. With a
+    screenshot_handle the screenshot was already staged and is not re-sent;
+    a screen delta is sent as one file per changed region.
+    """
     files = {}
-    if image_bytes:
-        files['screenshot'] = ('screenshot.png', image_bytes, 'image/png')
+    regions = getattr(image_bytes, "regions", None)
+    if image_bytes and not screenshot_handle:
+        if regions:
+            # A screen delta: one file per changed region, placed by screenshot_regions
+            extension = image_bytes.filename.rsplit('.', 1)[-1]
+            for i, region in enumerate(regions["regions"]):
+                part = image_bytes[region["offset"]:region["offset"] + region["length"]]
+                files[f'region_{i}'] = (f'region_{i}.{extension}', part, image_bytes.mime_type)
+        else:
+            files['screenshot'] = _image_part(image_bytes)
 
     # Use 'speech' format when TTS is enabled (plain text without markdown)
     # Use 'md' format when TTS is disabled (full markdown for rendering)
@@ -30,23 +222,457 @@ def send_query(text, image_bytes, complexity="Mid", session_id=None, tts_enabled
         'query': text,
         'complexity': complexity,
         'response_format': response_format,
-        'has_screenshot': image_bytes is not None and len(image_bytes) > 0,
+        'has_screenshot': bool(screenshot_handle) or (image_bytes is not None and len(image_bytes) > 0),
         'tts_enabled': tts_enabled
     }
     if session_id:
         data['sessionId'] = session_id
-    
+    if screenshot_handle:
+        data['screenshot_handle'] = screenshot_handle
+    if regions and not screenshot_handle:
+        data['screenshot_regions'] = json.dumps({
+            'screen': regions['screen'],
+            'regions': [
+                {'x': r['x'], 'y': r['y'], 'width': r['width'], 'height': r['height'],
+                 'file': f'region_{i}'}
+                for i, r in enumerate(regions['regions'])
+            ]
+        })
+    if getattr(image_bytes, "unchanged", False):
+        # Same screen as the last query in this session
+        data['screenshot_unchanged'] = True
+    if race_preview:
+        # The quick Low half of a race: keep it out of the session's memory
+        data['race_preview'] = True
+    return data, files
+
+def _cache_key(text, image_bytes, complexity, session_id, tts_enabled):
+    """Response cache key, or None when caching is off."""
+    if not settings_manager.get_response_cache_settings()["enabled"]:
+        return None
+    if getattr(image_bytes, "full_frame", None) is not None:
+        # A thumbnail, marker or delta: key on the screenshot it stands in
+        # for, so asking again about the same screen finds the first answer
+        image_bytes = image_bytes.full_frame
+    elif (getattr(image_bytes, "unchanged", False) and not image_bytes) or getattr(image_bytes, "regions", None):
+        # A bare "same screen" marker or a delta only makes sense next to
+        # the earlier screenshots of its session
+        return None
+    response_format = 'speech' if tts_enabled else 'md'
+    return response_cache.make_key(text, image_bytes, complexity, response_format, session_id)
+
+def _cache_get(key):
+    if key is None:
+        return None
+    return response_cache.get(key, settings_manager.get_response_cache_settings()["ttl"])
+
+def _cache_put(key, response):
+    # Failures are not cached so the next attempt goes to the webhook
+    if key is None or not response or response.startswith("Error: "):
+        return
+    cache = settings_manager.get_response_cache_settings()
+    response_cache.put(key, response, cache["size"], cache["ttl"])
+
+def _parse_body(body):
+    """Extract the answer from a complete (non-streamed) webhook response body."""
+    # Assuming the webhook returns a JSON with an 'answer' or 'text' field, 
+    # or just plain text. Adjust based on actual n8n workflow.
     try:
-        response = requests.post(url, data=data, files=files)
-        response.raise_for_status()
-        
-        # Assuming the webhook returns a JSON with an 'answer' or 'text' field, 
-        # or just plain text. Adjust based on actual n8n workflow.
+        json_response = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(json_response, dict):
+        return json_response.get('output', json_response.get('text', str(json_response)))
+    return str(json_response)
+
+def _chunk_text(payload):
+    """Pull the text out of one streamed JSON chunk, or None if it carries none."""
+    if isinstance(payload, str):
+        return payload
+    if not isinstance(payload, dict):
+        return None
+    # n8n streaming: {"type": "item", "content": "..."}; also accept OpenAI-style deltas
+    if payload.get("type") == "item":
+        return payload.get("content") or ""
+    for key in ("content", "text", "delta", "output"):
+        value = payload.get(key)
+        if isinstance(value, str):
+            return value
+    return None
+
+_STREAM_HEADERS = {"Accept": "text/event-stream, application/x-ndjson, application/json"}
+
+class _StreamParser:
+    """
+    Turns the lines of a streamed webhook response into text chunks.
+
+    Handles Server-Sent Events (text/event-stream) and n8n's streaming mode
+    (one JSON object per line). Anything else is treated as a normal,
+    non-streamed body and parsed once it is complete (see finish()), so
+    every answer is read through it whether or not it was asked to stream.
+    """
+
+    def __init__(self, content_type):
+        self._mode = "sse" if "text/event-stream" in content_type else None
+        self._body = []
+        self.done = False
+
+    def feed(self, line):
+        """Return the text carried by one line, or None."""
+        if self._mode == "sse":
+            if not line.startswith("data:"):
+                return None
+            data = line[5:].strip()
+            if data == "[DONE]":
+                self.done = True
+                return None
+            try:
+                return _chunk_text(json.loads(data)) or None
+            except ValueError:
+                return data or None
+
+        if self._mode is None:
+            # The first line tells an n8n stream from a plain body
+            try:
+                payload = json.loads(line)
+            except ValueError:
+                payload = None
+            is_stream = isinstance(payload, dict) and payload.get("type") in ("begin", "item", "end", "error")
+            self._mode = "ndjson" if is_stream else "body"
+
+        if self._mode == "ndjson":
+            try:
+                payload = json.loads(line)
+            except ValueError:
+                return None
+            if not isinstance(payload, dict):
+                return None
+            if payload.get("type") == "error":
+                raise QueryError(payload.get("content", "stream error"))
+            if payload.get("type") == "item":
+                return _chunk_text(payload) or None
+            return None
+
+        self._body.append(line)
+        return None
+
+    def finish(self):
+        """Return the answer of a non-streamed body, or None."""
+        if self._mode == "body":
+            return _parse_body("\n".join(self._body))
+        return None
+
+def _encode_form(data, files):
+    """Encode form fields and (filename, bytes, MIME type) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in data.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f'{value}\r\n').encode("utf-8")
+    for name, (filename, content, content_type) in files.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                 f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n').encode("utf-8")
+        body += content
+        body += b"\r\n"
+    body += f"--{boundary}--\r\n".encode("utf-8")
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+class _UploadBody(aiohttp.BytesPayload):
+    """
+    Multipart request body that enforces the upload timeout. It is written
+    block by block, so a stalled upload is noticed between blocks; aiohttp
+    only starts the first-byte (sock_read) timer once the body is sent.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, data, files, timeout):
+        body, content_type = _encode_form(data, files)
+        super().__init__(body, content_type=content_type)
+        self._timeout = timeout
+        self.timed_out = False
+
+    async def write(self, writer):
+        await self.write_with_length(writer, None)
+
+    async def write_with_length(self, writer, content_length):
+        body = memoryview(self._value)[:content_length]
+        deadline = time.monotonic() + self._timeout
+        for start in range(0, len(body), self.BLOCK_SIZE):
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                await asyncio.wait_for(writer.write(body[start:start + self.BLOCK_SIZE]), remaining)
+            except asyncio.TimeoutError:
+                self.timed_out = True
+                raise _UploadTimeout()
+
+
+def _http_error(status, reason, url):
+    kind = "Client" if status < 500 else "Server"
+    return HTTPStatusError(status, f"{status} {kind} Error: {reason} for url: {url}")
+
+async def _post(url, data, files, stream=True, on_chunk=None, parts=None):
+    """
+    One attempt at a query with per-phase timeouts: connect, upload (sending
+    the body) and first byte (waiting for the response). Appends the text
+    chunks to parts as they arrive and returns the full answer.
+    """
+    session = await _get_session()
+    timeouts = settings_manager.get_http_timeouts()
+    body = _UploadBody(data, files, timeouts["upload"])
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=timeouts["connect"], sock_read=timeouts["first_byte"]
+    )
+    headers = _STREAM_HEADERS if stream else None
+    try:
+        async with session.post(url, data=body, headers=headers, timeout=timeout) as response:
+            if response.status >= 400:
+                raise _http_error(response.status, response.reason, url)
+            parser = _StreamParser(response.headers.get("Content-Type", ""))
+            async for raw in response.content:
+                chunk = parser.feed(raw.decode("utf-8", "replace").rstrip("\r\n"))
+                if chunk:
+                    parts.append(chunk)
+                    if on_chunk:
+                        on_chunk(chunk)
+                if parser.done:
+                    break
+            rest = parser.finish()
+            if rest is not None:
+                parts.append(rest)
+                if on_chunk:
+                    on_chunk(rest)
+            return "".join(parts)
+    except aiohttp.ClientError as e:
+        if body.timed_out:
+            raise WebhookTimeout(f"Uploading the query took longer than {timeouts['upload']}s")
+        if isinstance(e, aiohttp.ConnectionTimeoutError):
+            raise ConnectTimeout(f"Could not connect to the webhook within {timeouts['connect']}s")
+        if isinstance(e, aiohttp.ServerTimeoutError):
+            raise WebhookTimeout(f"No response from the webhook within {timeouts['first_byte']}s")
+        if isinstance(e, aiohttp.ClientConnectionError):
+            raise WebhookConnectionError(str(e) or type(e).__name__)
+        raise QueryError(str(e) or type(e).__name__)
+
+def _is_retryable(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, HTTPStatusError):
+        return error.status in RETRY_STATUS_CODES
+    # Includes ConnectTimeout; read/upload timeouts are not retried because
+    # the webhook may already be working on the query
+    return isinstance(error, WebhookConnectionError)
+
+def _error_response(error, partial=False):
+    response = ErrorResponse(f"Error: {error}")
+    response.offline = not partial and (
+        isinstance(error, CircuitOpenError) or _is_retryable(error)
+    )
+    return response
+
+def _backoff_delay(attempt):
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+async def _call_with_retries(attempt, can_retry=None):
+    """
+    Await attempt() through the circuit breaker, retrying retryable failures
+    with jittered exponential backoff. The request payload (including the
+    encoded screenshot) is built once by the caller and reused. Cancelling
+    the task also cancels the backoff sleep.
+    """
+    retries = settings_manager.get_retry_attempts()
+    for n in range(retries + 1):
+        trial = _breaker.before_call()
         try:
-            json_response = response.json()
-            return json_response.get('output', json_response.get('text', str(json_response)))
-        except ValueError:
-            return response.text
-            
-    except requests.exceptions.RequestException as e:
-        return f"Error: {e}"
+            result = await attempt()
+        except QueryError as e:
+            if not _is_retryable(e):
+                # The endpoint answered, so it is up
+                _breaker.record_success()
+                raise
+            _breaker.record_failure()
+            if n == retries or (can_retry is not None and not can_retry()):
+                raise
+            delay = _backoff_delay(n)
+            print(f"Webhook request failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled (or otherwise interrupted) before a verdict: don't
+            # leave the breaker waiting for a trial that will never report
+            if trial:
+                _breaker.release_trial()
+            raise
+        else:
+            _breaker.record_success()
+            return result
+
+async def query_async(text, image_bytes, complexity="Mid", session_id=None, tts_enabled=False,
+                      on_chunk=None, stream=True, use_cache=True, screenshot_handle=None,
+                      race_preview=False):
+    """
+    Sends the text query and image to the n8n webhook. Must run on the
+    shared event loop; cancel it by cancelling its task.
+
+    Args:
+        text (str): The user's question.
+        image_bytes (bytes): The screenshot image data.
+        complexity (str): The complexity level (Low, Mid, High).
+        session_id (str): The session ID for context.
+        tts_enabled (bool): Whether TTS is enabled (affects response format).
+        on_chunk (callable): Called with each piece of a streamed (chunked/SSE)
+            answer as it arrives; a normal or cached answer comes in one piece.
+        stream (bool): Ask the webhook for a streamed answer.
+        use_cache (bool): Answer from the local response cache when possible.
+            Pass False to always ask the webhook (the answer is still cached).
+        screenshot_handle (str or Future): Handle from stage_screenshot. The
+            query then references the staged upload instead of carrying
+            image_bytes; if staging failed the bytes are sent as usual.
+        race_preview (bool): Mark the query as the quick Low answer of a race
+            mode query, which the workflow keeps out of the chat's memory.
+
+    Returns:
+        str: The response text from the webhook, or an ErrorResponse.
+    """
+    loop = asyncio.get_running_loop()
+    cache_key = _cache_key(text, image_bytes, complexity, session_id, tts_enabled)
+    # The cache reads and writes a file, so keep it off the loop
+    cached = await loop.run_in_executor(None, _cache_get, cache_key) if use_cache else None
+    if cached is not None:
+        if on_chunk:
+            on_chunk(cached)
+        return cached
+
+    if isinstance(screenshot_handle, concurrent.futures.Future):
+        try:
+            screenshot_handle = await asyncio.wait_for(
+                asyncio.wrap_future(screenshot_handle),
+                settings_manager.get_http_timeouts()["upload"]
+            )
+        except Exception as e:
+            print(f"Screenshot staging failed ({e}); sending it with the query")
+            screenshot_handle = None
+
+    url = settings_manager.get_webhook_url()
+    data, files = _build_payload(text, image_bytes, complexity, session_id, tts_enabled,
+                                 screenshot_handle, race_preview)
+    parts = []
+
+    try:
+        # Once part of the answer has been shown, a retry would duplicate it
+        result = await _call_with_retries(
+            lambda: _post(url, data, files, stream, on_chunk, parts),
+            can_retry=lambda: not parts
+        )
+    except QueryError as e:
+        return _error_response(e, partial=bool(parts))
+    await loop.run_in_executor(None, _cache_put, cache_key, result)
+    return result
+
+def submit_query(text, image_bytes, complexity="Mid", session_id=None, tts_enabled=False,
+                 on_chunk=None, stream=True, handle=None, use_cache=True,
+                 screenshot_handle=None, race_preview=False):
+    """
+    Start a query (see query_async) on the shared event loop without
+    blocking the caller.
+
+    on_chunk(text) is called from the event-loop thread as streamed pieces
+    arrive. Cancelling the handle (or the future) aborts the query.
+
+    Returns:
+        concurrent.futures.Future: Resolves to the response text; poll it
+        with done() from the Tk thread.
+    """
+    handle = handle or QueryHandle()
+    future = event_loop.submit(query_async(text, image_bytes, complexity, session_id, tts_enabled,
+                                           on_chunk, stream, use_cache, screenshot_handle,
+                                           race_preview))
+    handle._attach_future(future)
+    return future
+
+def send_query(text, image_bytes, complexity="Mid", session_id=None, tts_enabled=False,
+               handle=None, use_cache=True, screenshot_handle=None):
+    """
+    Blocking version of submit_query for worker threads (never call it from
+    the event-loop thread).
+
+    Returns:
+        str: The response text from the webhook, or an ErrorResponse.
+
+    Raises:
+        QueryCancelled: If the query was cancelled through its handle.
+    """
+    future = submit_query(text, image_bytes, complexity, session_id, tts_enabled,
+                          stream=False, handle=handle, use_cache=use_cache,
+                          screenshot_handle=screenshot_handle)
+    try:
+        return future.result()
+    except concurrent.futures.CancelledError:
+        raise QueryCancelled()
+
+# Pre-warming: opening the pooled connection while the user is still typing
+# takes DNS, TCP and TLS setup off the critical path of the next query.
+PREWARM_MIN_INTERVAL = 10.0  # seconds between pre-warms
+_last_prewarm = 0.0
+
+async def _prewarm(url, timeout):
+    try:
+        session = await _get_session()
+        async with session.head(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Webhook pre-warm failed: {e}")
+
+def prewarm():
+    """
+    Open (or refresh) a pooled keep-alive connection to the webhook in the
+    background. The HEAD request does not trigger the workflow; its status
+    is ignored. Returns the future, or None if a pre-warm ran recently.
+    """
+    global _last_prewarm
+    now = time.monotonic()
+    if now - _last_prewarm < PREWARM_MIN_INTERVAL or _breaker.is_open:
+        return None
+    _last_prewarm = now
+
+    url = settings_manager.get_webhook_url()
+    timeout = settings_manager.get_http_timeouts()["connect"]
+    return event_loop.submit(_prewarm(url, timeout))
+
+# Two-phase upload: the screenshot is uploaded to a staging endpoint while
+# the user types, and the query only carries the handle it returned. See
+# staging_server.py for the expected API and a local stand-in.
+def _staging_handle(body):
+    handle = json.loads(body).get("handle")
+    if not handle:
+        raise ValueError("staging endpoint returned no handle")
+    return handle
+
+async def _stage(url, image, timeouts):
+    if isinstance(image, concurrent.futures.Future):
+        image = await asyncio.wrap_future(image)
+    session = await _get_session()
+    body = _UploadBody({}, {'screenshot': _image_part(image)}, timeouts["upload"])
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=timeouts["connect"], sock_read=timeouts["first_byte"]
+    )
+    async with session.post(url, data=body, timeout=timeout) as response:
+        if response.status >= 400:
+            raise _http_error(response.status, response.reason, url)
+        return _staging_handle(await response.text())
+
+def stage_screenshot(image):
+    """
+    Upload a screenshot (encoded bytes, or a Future of them) to the staging
+    endpoint in the background.
+
+    Returns:
+        concurrent.futures.Future: Resolves to the handle to pass as
+        screenshot_handle, or None if no staging_url is configured.
+    """
+    url = settings_manager.get_staging_url()
+    if not url:
+        return None
+    return event_loop.submit(_stage(url, image, settings_manager.get_http_timeouts()))
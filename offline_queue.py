@@ -0,0 +1,166 @@
+"""
+Durable outbox for queries that could not reach the webhook.
+
+Each queued query is stored under QUEUE_DIR as a JSON file (plus the
+screenshot bytes next to it) named so that files sort in submission order.
+A background worker resends the oldest query once the webhook is reachable
+again and saves the answer into the query's session, so nothing is lost
+while offline and replies arrive in the order the questions were asked.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+import n8n_client
+import screenshot_utils
+import settings_manager
+
+QUEUE_DIR = "offline_queue"
+
+# Seconds between attempts to resend while the webhook is still unreachable
+REPLAY_INTERVAL = 15.0
+
+_lock = threading.Lock()
+_wake_event = threading.Event()
+_worker_thread = None
+_delivered = []  # session ids with answers delivered since the last pop_delivered()
+
+
+def _item_names():
+    try:
+        names = os.listdir(QUEUE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(n[:-len(".json")] for n in names if n.endswith(".json"))
+
+
+def _write_atomic(path, data, mode="w"):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def enqueue(session_id, query, image_bytes=None, complexity="Mid", tts_enabled=False):
+    """Store a query for later delivery and make sure the worker is running."""
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    item = {
+        "session_id": session_id,
+        "query": query,
+        "complexity": complexity,
+        "tts_enabled": tts_enabled,
+        "has_screenshot": bool(image_bytes),
+        "screenshot_type": getattr(image_bytes, "mime_type", "image/png"),
+        "screenshot_unchanged": getattr(image_bytes, "unchanged", False),
+        "screenshot_regions": getattr(image_bytes, "regions", None),
+        "queued_at": time.time()
+    }
+    with _lock:
+        os.makedirs(QUEUE_DIR, exist_ok=True)
+        # Screenshot first, so a listed item always has its image on disk
+        if image_bytes:
+            _write_atomic(os.path.join(QUEUE_DIR, name + ".img"), image_bytes, "wb")
+        _write_atomic(os.path.join(QUEUE_DIR, name + ".json"), json.dumps(item))
+    start()
+    _wake_event.set()
+
+
+def _load(name):
+    with open(os.path.join(QUEUE_DIR, name + ".json"), "r") as f:
+        item = json.load(f)
+    image_bytes = None
+    if item.get("has_screenshot"):
+        with open(os.path.join(QUEUE_DIR, name + ".img"), "rb") as f:
+            image_bytes = f.read()
+    if image_bytes is not None or item.get("screenshot_unchanged"):
+        # Keep the MIME type, unchanged marker and delta regions so the query is sent as it was
+        image_bytes = screenshot_utils.EncodedImage(
+            image_bytes or b"", item.get("screenshot_type", "image/png"),
+            item.get("screenshot_unchanged", False), item.get("screenshot_regions")
+        )
+    return item, image_bytes
+
+
+def _remove(name):
+    for suffix in (".json", ".img"):
+        try:
+            os.remove(os.path.join(QUEUE_DIR, name + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def status():
+    """Return (number of queued queries, age in seconds of the oldest one)."""
+    with _lock:
+        names = _item_names()
+    if not names:
+        return 0, 0.0
+    oldest = int(names[0].split("-", 1)[0]) / 1e9
+    return len(names), max(0.0, time.time() - oldest)
+
+
+def pop_delivered():
+    """Return the session ids that received queued answers since the last call."""
+    with _lock:
+        sessions = list(_delivered)
+        del _delivered[:]
+    return sessions
+
+
+def _deliver_next():
+    """
+    Try to send the oldest queued query. Returns False if the webhook is
+    still unreachable (or the queue is empty) and True otherwise.
+    """
+    with _lock:
+        names = _item_names()
+    if not names:
+        return False
+    name = names[0]
+    try:
+        item, image_bytes = _load(name)
+    except Exception as e:
+        print(f"Dropping unreadable queued query {name}: {e}")
+        _remove(name)
+        return True
+
+    response = n8n_client.send_query(
+        item["query"], image_bytes, item["complexity"], item["session_id"],
+        item["tts_enabled"], use_cache=False
+    )
+    if getattr(response, "offline", False):
+        return False
+
+    # Answers (or permanent errors) go into the session the query came from
+    settings_manager.save_interaction(item["session_id"], item["query"], response)
+    with _lock:
+        _remove(name)
+        _delivered.append(item["session_id"])
+    return True
+
+
+def _worker_loop():
+    while True:
+        try:
+            delivered = _deliver_next()
+        except Exception as e:
+            print(f"Error replaying offline queue: {e}")
+            delivered = False
+        if not delivered:
+            # Queue empty or webhook still down: wait for a new item or the next attempt
+            _wake_event.wait(REPLAY_INTERVAL)
+            _wake_event.clear()
+
+
+def start():
+    """Start the replay worker (call at startup to resend queries left from last run)."""
+    global _worker_thread
+    with _lock:
+        if _worker_thread is None:
+            _worker_thread = threading.Thread(target=_worker_loop, daemon=True)
+            _worker_thread.start()
@@ -1,14 +1,26 @@
 import customtkinter as ctk
+import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import keyboard
 import re
 import config
 import screenshot_utils
 import n8n_client
+import offline_queue
 import settings_manager
 import voice_utils
 import tts_utils
 
+# History searches run here, one at a time, so the Tk thread never waits on
+# the database or the archive
+_search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-search")
+
+# Shown in place of an answer when the query went to the offline queue
+QUEUED_NOTICE = ("⏳ The webhook can't be reached, so this question was queued. "
+                 "The answer will be added to this chat once it is back.")
+
 
 class HotkeyCapture(ctk.CTkFrame):
     """Widget for capturing hotkey input with a Set button."""
@@ -283,6 +295,11 @@ class OverlayApp(ctk.CTk):
         )
         self.screenshot_switch.pack(side="left")
 
+        # Offline queue status (hidden while the queue is empty)
+        self.queue_label = ctk.CTkLabel(
+            self.header_frame, text="", font=("Arial", 10), text_color="#f59e0b"
+        )
+
         # Right section: Window controls
         self.header_right = ctk.CTkFrame(self.header_frame, fg_color="transparent")
         self.header_right.grid(row=0, column=2, sticky="e")
@@ -311,11 +328,21 @@ class OverlayApp(ctk.CTk):
             fg_color="transparent", scrollbar_button_color="#444"
         )
         self.result_textbox.pack(fill="both", expand=True, padx=8, pady=8)
+        # Load earlier turns of long sessions when scrolled to the top
+        for sequence in ("<MouseWheel>", "<Button-4>"):
+            self.result_textbox.bind(sequence, self._on_chat_scroll, add="+")
 
         self.retry_btn = ctk.CTkButton(
             self.result_frame, text="Retry", width=60, height=24,
             font=("Arial", 11), fg_color="#dc3545", hover_color="#c82333",
-            command=self.on_submit
+            command=self.retry_query
+        )
+
+        # Race mode: keep the quick answer and stop waiting for the better one
+        self.accept_btn = ctk.CTkButton(
+            self.result_frame, text="Use this answer", width=110, height=24,
+            font=("Arial", 11), fg_color="#10b981", hover_color="#059669",
+            command=self.accept_fast_answer
         )
 
         # ============ ROW 2: INPUT (sticky bottom) ============
@@ -329,7 +356,10 @@ class OverlayApp(ctk.CTk):
         )
         self.entry.grid(row=0, column=0, sticky="ew", padx=(12, 0), pady=4)
         self.entry.bind("<Return>", self.on_submit)
-        self.entry.bind("<Escape>", self.hide_overlay)
+        # Shift+Enter always asks the webhook, skipping the response cache
+        self.entry.bind("<Shift-Return>", lambda e: self.on_submit(use_cache=False))
+        # Esc cancels an in-flight query, otherwise hides the overlay
+        self.bind("<Escape>", self._on_escape)
 
         self.mic_btn = ctk.CTkButton(
             self.input_frame, text="🎤", width=32, height=28,
@@ -357,6 +387,14 @@ class OverlayApp(ctk.CTk):
         self.history_window = None
         self.current_session_id = None
         self.chat_messages = []  # Track current conversation
+        self.chat_cursor = None  # Cursor for earlier, not yet loaded messages
+        self._stream_started = False  # First chunk of a streamed answer shown
+        self._query_handle = None  # Set while a query is in flight
+        self._last_request = None  # (query, screenshot_bytes, complexity) for Retry
+        self._precaptured = None  # (monitor, time, image, encoded image Future, staging Future, delta) from show_overlay
+        self._screen_fingerprints = {}  # session id -> fingerprint of the last screenshot sent
+        self._screen_tiles = {}  # session id -> tile hashes of the last screenshot sent (deltas)
+        self._race = None  # State of a race-mode query (see _start_race)
         self.voice_hotkey_id = None
         self.setup_window = None
 
@@ -367,6 +405,8 @@ class OverlayApp(ctk.CTk):
         if settings_manager.is_first_run():
             self.after(100, self.show_first_run_setup)
 
+        self._poll_offline_queue()
+
     def register_voice_hotkey(self, hotkey):
         """Register or update the voice hotkey."""
         # Remove old hotkey if exists
@@ -700,14 +740,90 @@ class OverlayApp(ctk.CTk):
                 self.after(100, self.on_submit)
 
     def show_overlay(self):
+        # Grab the screen before the overlay covers it; encoding runs in the background
+        self._precaptured = None
+        if self.screenshot_var.get() and settings_manager.get_prewarm_screenshot():
+            try:
+                monitor_index = settings_manager.get_selected_monitor()
+                encoding = settings_manager.get_screenshot_encoding()
+                img = screenshot_utils.capture_screen(monitor_index, max_edge=encoding["max_edge"])
+                encoded = screenshot_utils.encode_image_async(img, **encoding)
+                # With a staging endpoint, upload it too while the user types
+                staged = n8n_client.stage_screenshot(encoded)
+                self._precaptured = (monitor_index, time.monotonic(), img, encoded, staged,
+                                     self._precompute_delta(img, encoding))
+            except Exception as e:
+                print(f"Error pre-capturing screen: {e}")
+
         self.deiconify()
         self.entry.focus_set()
         self.is_visible = True
         # Don't reset UI - keep window size and chat state as is
+        self._prewarm()
+
+    def _prewarm(self):
+        """Get ready for the next query while the user is typing."""
+        n8n_client.prewarm()
+        threading.Thread(target=self._refresh_monitors, daemon=True).start()
+
+    def _refresh_monitors(self):
+        try:
+            monitors = screenshot_utils.refresh_monitors()
+        except Exception as e:
+            print(f"Error reading monitors: {e}")
+            return
+        if [m["name"] for m in monitors] != self.monitor_names:
+            self.after(0, self._update_monitor_menu, monitors)
+
+    def _update_monitor_menu(self, monitors):
+        """Apply a changed monitor layout to the monitor dropdown."""
+        self.monitor_names = [m["name"] for m in monitors]
+        self.monitor_map = {m["name"]: m["index"] for m in monitors}
+        self.monitor_menu.configure(values=self.monitor_names)
+        if self.monitor_var.get() not in self.monitor_names and self.monitor_names:
+            self.monitor_var.set(self.monitor_names[0])
+            settings_manager.set_selected_monitor(self.monitor_map[self.monitor_names[0]])
+
+    def _precompute_delta(self, img, encoding):
+        """
+        With screenshot_deltas on, start working out img's delta against the
+        last screenshot sent in this chat on the encoder thread. Returns
+        (tile hashes compared with, Future) for _screen_delta, or None.
+        """
+        if not settings_manager.get_screenshot_deltas():
+            return None
+        previous = self._screen_tiles.get(self.current_session_id)
+        return previous, screenshot_utils.screen_delta_async(
+            img, previous, image_format=encoding["image_format"], quality=encoding["quality"],
+            max_changed=settings_manager.get_delta_full_frame_ratio()
+        )
+
+    def _take_precaptured(self):
+        """
+        Return (image, image bytes, staging Future or None, delta) for the
+        screenshot taken in show_overlay, or (None, None, None, None) if there
+        is none or it is out of date.
+        """
+        precaptured, self._precaptured = self._precaptured, None
+        if precaptured is None:
+            return None, None, None, None
+        monitor_index, taken, img, encoded, staged, delta = precaptured
+        if (monitor_index != settings_manager.get_selected_monitor()
+                or time.monotonic() - taken > config.PRECAPTURE_MAX_AGE):
+            encoded.cancel()
+            if delta is not None:
+                delta[1].cancel()
+            return None, None, None, None
+        try:
+            return img, encoded.result(), staged, delta
+        except Exception as e:
+            print(f"Error encoding screenshot: {e}")
+            return None, None, None, None
 
     def hide_overlay(self, event=None):
         self.withdraw()
         self.is_visible = False
+        self._precaptured = None
         # Also close settings/history if open
         if self.settings_window is not None and self.settings_window.winfo_exists():
             self.settings_window.destroy()
@@ -718,6 +834,7 @@ class OverlayApp(ctk.CTk):
 
     def close_app(self):
         """Close the application completely."""
+        settings_manager.flush()
         self.destroy()
 
     def reset_ui(self):
@@ -734,15 +851,17 @@ class OverlayApp(ctk.CTk):
     def new_chat(self):
         self.current_session_id = None
         self.chat_messages = []
+        self.chat_cursor = None
+        self._last_request = None
         self.entry.delete(0, 'end')
         self.result_textbox.configure(state="normal")
         self.result_textbox.delete("0.0", "end")
         self.result_textbox.configure(state="disabled")
         self.reset_ui()
 
-    def on_submit(self, event=None):
+    def on_submit(self, event=None, use_cache=True):
         query = self.entry.get()
-        if not query:
+        if not query or self._query_handle is not None:
             return
 
         complexity = self.complexity_var.get()
@@ -755,9 +874,12 @@ class OverlayApp(ctk.CTk):
         self.display_chat()
 
         include_screenshot = self.screenshot_var.get()
-        screenshot_bytes = None
+        # Use the screenshot taken when the overlay was shown, if there is one
+        img, screenshot_bytes, staged, delta = (
+            self._take_precaptured() if include_screenshot else (None, None, None, None)
+        )
 
-        if include_screenshot:
+        if include_screenshot and screenshot_bytes is None:
             # Hide window to take screenshot
             self.withdraw()
             # Force update to ensure window is gone
@@ -767,17 +889,116 @@ class OverlayApp(ctk.CTk):
             # Capture screen immediately while hidden
             try:
                 monitor_index = settings_manager.get_selected_monitor()
-                screenshot_bytes = screenshot_utils.capture_screen_bytes(monitor_index)
+                encoding = settings_manager.get_screenshot_encoding()
+                img = screenshot_utils.capture_screen(monitor_index, max_edge=encoding["max_edge"])
+                screenshot_bytes = screenshot_utils.encode_image(img, **encoding)
             except Exception as e:
                 print(f"Error capturing screen: {e}")
-                screenshot_bytes = None
+                img, screenshot_bytes = None, None
             
             # Restore window
             self.deiconify()
 
+        if img is not None and screenshot_bytes is not None:
+            if self._screen_unchanged(img):
+                # Same screen as the last query: send a thumbnail or just a marker
+                screenshot_bytes, staged = self._unchanged_screenshot(img, screenshot_bytes), None
+            else:
+                # Only part of it changed: send just those regions
+                delta = self._screen_delta(img, delta)
+                if delta is not None:
+                    delta.full_frame = screenshot_bytes
+                    screenshot_bytes, staged = delta, None
+
+        self._start_query(query, screenshot_bytes, complexity, use_cache, staged)
+
+    def _screen_unchanged(self, img):
+        """
+        True if img looks the same as the screenshot last sent in this chat.
+        Otherwise img becomes the screenshot later ones are compared with.
+        """
+        if settings_manager.get_unchanged_screenshot() == "full":
+            return False
+        try:
+            fingerprint = screenshot_utils.fingerprint(img)
+        except Exception as e:
+            print(f"Error fingerprinting screen: {e}")
+            return False
+        previous = self._screen_fingerprints.get(self.current_session_id)
+        if (previous is not None and screenshot_utils.screen_change(previous, fingerprint)
+                <= settings_manager.get_screen_change_threshold()):
+            return True
+        self._screen_fingerprints[self.current_session_id] = fingerprint
+        return False
+
+    def _unchanged_screenshot(self, img, screenshot_bytes):
+        """What to send instead of screenshot_bytes when the screen hasn't changed."""
+        if settings_manager.get_unchanged_screenshot() == "marker":
+            return screenshot_utils.EncodedImage(b"", unchanged=True, full_frame=screenshot_bytes)
+        try:
+            thumbnail = screenshot_utils.encode_image(
+                img, "jpeg", quality=75, max_edge=config.UNCHANGED_THUMBNAIL_EDGE
+            )
+        except Exception as e:
+            print(f"Error encoding thumbnail: {e}")
+            thumbnail = screenshot_bytes
+        if len(thumbnail) > len(screenshot_bytes):
+            thumbnail = screenshot_bytes
+        return screenshot_utils.EncodedImage(
+            thumbnail, getattr(thumbnail, "mime_type", "image/png"), unchanged=True,
+            full_frame=screenshot_bytes
+        )
+
+    def _screen_delta(self, img, precomputed=None):
+        """
+        With screenshot_deltas on, return the regions of img that changed since
+        the last screenshot sent in this chat, or None to send img whole.
+        precomputed is the delta _precompute_delta started for img; it is
+        used if it was compared with the same earlier screenshot.
+        """
+        if not settings_manager.get_screenshot_deltas():
+            return None
+        previous = self._screen_tiles.get(self.current_session_id)
+        try:
+            if precomputed is not None and precomputed[0] is previous:
+                tiles, delta = precomputed[1].result()
+            else:
+                encoding = settings_manager.get_screenshot_encoding()
+                tiles, delta = screenshot_utils.screen_delta(
+                    img, previous, encoding["image_format"], encoding["quality"],
+                    settings_manager.get_delta_full_frame_ratio()
+                )
+        except Exception as e:
+            print(f"Error computing screen delta: {e}")
+            # img goes out whole, so the next screenshot is sent whole too
+            self._screen_tiles.pop(self.current_session_id, None)
+            return None
+        # Whatever is sent, the webhook will have this screen next time
+        self._screen_tiles[self.current_session_id] = tiles
+        return delta
+
+    def _forget_screen(self, session_id):
+        """The webhook may not have the last screenshot: send the next one whole."""
+        self._screen_fingerprints.pop(session_id, None)
+        self._screen_tiles.pop(session_id, None)
+
+    def retry_query(self):
+        """Resend the failed query with the screenshot it was first sent with."""
+        if self._query_handle is not None:
+            return
+        if self._last_request is None:
+            self.on_submit()
+            return
+        self._start_query(*self._last_request, use_cache=False)
+
+    def _start_query(self, query, screenshot_bytes, complexity, use_cache=True, staged=None):
+        # Kept so Retry can resend without capturing the screen again
+        self._last_request = (query, screenshot_bytes, complexity)
+
         # Show loading state
         self.entry.configure(state="disabled")
-        self.send_btn.configure(state="disabled", text="·")
+        # Send button doubles as Stop while the query runs
+        self.send_btn.configure(text="■", command=self.cancel_query)
         self.progress_bar.grid(row=1, column=0, columnspan=3, sticky="ew", padx=0, pady=0)
         self.progress_bar.start()
         self.retry_btn.pack_forget() # Hide retry button while loading
@@ -785,27 +1006,244 @@ class OverlayApp(ctk.CTk):
         # Get TTS enabled state for response format
         tts_enabled = settings_manager.get_tts_enabled()
 
-        # Start background thread, passing the captured screenshot and tts state
-        threading.Thread(target=self.process_query, args=(query, screenshot_bytes, complexity, self.current_session_id, tts_enabled), daemon=True).start()
+        self._stream_started = False
+        handle = n8n_client.QueryHandle()
+        self._query_handle = handle
 
-    def process_query(self, query, screenshot_bytes, complexity, session_id, tts_enabled):
-        try:
-            # If screenshot was requested but failed, we might still want to proceed?
-            # Or if it wasn't requested, it is None.
-            # n8n_client handles None.
+        # Journal the query before sending so it survives a crash mid-request
+        entry_id = settings_manager.begin_interaction(self.current_session_id, query)
 
-            # Send to n8n with tts_enabled to control response format
-            response = n8n_client.send_query(query, screenshot_bytes, complexity, session_id, tts_enabled)
-            
-            # Save to history (session)
-            settings_manager.save_interaction(session_id, query, response)
+        # What the offline queue needs to send the query again later
+        request = {
+            "session_id": self.current_session_id, "query": query, "image_bytes": screenshot_bytes,
+            "complexity": complexity, "tts_enabled": tts_enabled
+        }
+        if complexity != "Low" and settings_manager.get_race_mode():
+            self._start_race(request, entry_id, handle, use_cache, staged)
+            return
+
+        # Run the query on the shared event loop; streamed chunks are queued
+        # and shown by _poll_query on the Tk thread
+        chunks = queue.SimpleQueue()
+        future = n8n_client.submit_query(
+            query, screenshot_bytes, complexity, self.current_session_id, tts_enabled,
+            on_chunk=chunks.put, stream=settings_manager.get_stream_responses(),
+            handle=handle, use_cache=use_cache, screenshot_handle=staged
+        )
+        self._poll_query(future, chunks, entry_id, handle, request)
 
-            # Update UI on main thread
-            self.after(0, self.show_result, response)
+    def _poll_query(self, future, chunks, entry_id, handle, request):
+        """Show streamed chunks and, once the future is done, the answer."""
+        # Check done() before draining so no chunk lands after the last drain
+        done = future.done()
+        while True:
+            try:
+                self._append_stream_chunk(chunks.get_nowait(), handle)
+            except queue.Empty:
+                break
+        if not done:
+            self.after(config.QUERY_POLL_INTERVAL, self._poll_query, future, chunks, entry_id, handle, request)
+            return
+
+        if future.cancelled():
+            # The UI was already reset by cancel_query
+            settings_manager.abandon_interaction(entry_id)
+            return
+        try:
+            response = future.result()
+        except n8n_client.QueryCancelled:
+            settings_manager.abandon_interaction(entry_id)
+            return
         except Exception as e:
-            self.after(0, self.show_result, f"Error: {str(e)}", True)
+            settings_manager.abandon_interaction(entry_id)
+            self._forget_screen(request["session_id"])
+            self.show_result(f"Error: {str(e)}", True, handle)
+            return
+        self._finish_query(response, entry_id, handle, request)
+
+    def _finish_query(self, response, entry_id, handle, request):
+        """Save and show the final response of a query (or queue it if offline)."""
+        if getattr(response, "offline", False) and settings_manager.get_offline_queue_enabled():
+            # The webhook is unreachable: keep the query and send it when it is back
+            settings_manager.abandon_interaction(entry_id)
+            # The webhook hasn't seen this screenshot, and the next live query
+            # may reach it before the queued one: send that one whole
+            self._forget_screen(request["session_id"])
+            try:
+                offline_queue.enqueue(**request)
+            except Exception as e:
+                print(f"Error queueing query: {e}")
+                self.show_result(response, True, handle)
+                return
+            self.show_result(QUEUED_NOTICE, False, handle, speak=False)
+            self._poll_offline_queue(reschedule=False)
+            return
+
+        if isinstance(response, n8n_client.ErrorResponse):
+            # Not an answer: keep it out of history and offer Retry, which
+            # resends the same request (_last_request)
+            settings_manager.abandon_interaction(entry_id)
+            self._forget_screen(request["session_id"])
+            self.show_result(response, True, handle)
+            return
+
+        # Save to history (session) via the journal
+        settings_manager.complete_interaction(entry_id, response)
+        self.show_result(response, False, handle)
+
+    def _start_race(self, request, entry_id, handle, use_cache, staged):
+        """
+        Race mode: ask the Low tier and the selected tier at the same time.
+        The Low answer is shown as soon as it arrives and replaced by the
+        selected tier's answer, unless the user accepts it first.
+        """
+        slow_handle = n8n_client.QueryHandle()
+        self._race = {
+            "handle": handle, "slow_handle": slow_handle, "entry_id": entry_id,
+            "request": request, "fast_answer": None, "fast_failed": False
+        }
+        chunks = queue.SimpleQueue()
+        fast = n8n_client.submit_query(
+            request["query"], request["image_bytes"], "Low", request["session_id"],
+            request["tts_enabled"], on_chunk=chunks.put,
+            stream=settings_manager.get_stream_responses(), handle=handle,
+            use_cache=use_cache, screenshot_handle=staged, race_preview=True
+        )
+        slow = n8n_client.submit_query(
+            request["query"], request["image_bytes"], request["complexity"], request["session_id"],
+            request["tts_enabled"], stream=False, handle=slow_handle,
+            use_cache=use_cache, screenshot_handle=staged
+        )
+        self._poll_race(fast, slow, chunks, handle)
+
+    @staticmethod
+    def _future_answer(future):
+        """Return the answer of a finished query future, or None if it failed."""
+        if future.cancelled():
+            return None
+        try:
+            response = future.result()
+        except Exception:
+            return None
+        if isinstance(response, n8n_client.ErrorResponse):
+            return None
+        return response
+
+    def _poll_race(self, fast, slow, chunks, handle):
+        race = self._race
+        if race is None or race["handle"] is not handle:
+            return  # Cancelled, or the quick answer was accepted
+
+        fast_done, slow_done = fast.done(), slow.done()
+        if race["fast_answer"] is None:
+            while True:
+                try:
+                    self._append_stream_chunk(chunks.get_nowait(), handle)
+                except queue.Empty:
+                    break
+
+        if fast_done and race["fast_answer"] is None and not race["fast_failed"]:
+            answer = self._future_answer(fast)
+            if answer is None:
+                race["fast_failed"] = True
+            else:
+                race["fast_answer"] = answer
+                self._show_provisional(answer)
+
+        if slow_done:
+            answer = self._future_answer(slow)
+            if answer is None:
+                answer = race["fast_answer"]
+            if answer is not None:
+                self._end_race(answer)
+                return
+            if fast_done:
+                # Both tiers failed: report the selected tier's error
+                self._race = None
+                self._poll_query(slow, chunks, race["entry_id"], handle, race["request"])
+                return
+
+        self.after(config.QUERY_POLL_INTERVAL, self._poll_race, fast, slow, chunks, handle)
+
+    def _show_provisional(self, answer):
+        """Show the quick answer while the selected tier is still working."""
+        self.chat_messages.append({"role": "assistant", "content": answer})
+        self._race["provisional"] = True
+        self.display_chat()
+        self.accept_btn.pack(pady=5)
+        # Streaming the quick answer hid the progress bar; the slow tier is still running
+        self.progress_bar.grid(row=1, column=0, columnspan=3, sticky="ew", padx=0, pady=0)
+        self.progress_bar.start()
+
+    def _end_race(self, answer):
+        race, self._race = self._race, None
+        race["handle"].cancel()
+        race["slow_handle"].cancel()
+        self.accept_btn.pack_forget()
+        if race.get("provisional"):
+            self.chat_messages.pop()
+        self._finish_query(answer, race["entry_id"], race["handle"], race["request"])
+
+    def accept_fast_answer(self):
+        """Keep the quick answer and cancel the slower, better one."""
+        if self._race is not None and self._race["fast_answer"] is not None:
+            self._end_race(self._race["fast_answer"])
+
+    def cancel_query(self, event=None):
+        """Abort the in-flight query and return the input to the user."""
+        handle = self._query_handle
+        if handle is None:
+            return
+        handle.cancel()
+        self._query_handle = None
+        self._forget_screen(self.current_session_id)
+
+        race, self._race = self._race, None
+        if race is not None:
+            race["slow_handle"].cancel()
+            settings_manager.abandon_interaction(race["entry_id"])
+            self.accept_btn.pack_forget()
+            if race.get("provisional"):
+                self.chat_messages.pop()
+
+        self.progress_bar.stop()
+        self.progress_bar.grid_forget()
+        # Drop the unanswered question from the chat; it is still in the entry
+        if self.chat_messages and self.chat_messages[-1].get("role") == "user":
+            self.chat_messages.pop()
+        if self.chat_messages:
+            self.display_chat()
+        else:
+            self.result_frame.grid_forget()
+
+        self.entry.configure(state="normal")
+        self.send_btn.configure(state="normal", text="↑", command=self.on_submit)
+        self.entry.focus_set()
+
+    def _on_escape(self, event=None):
+        if self._query_handle is not None:
+            self.cancel_query()
+        else:
+            self.hide_overlay()
+
+    def _append_stream_chunk(self, chunk, handle=None):
+        """Append a streamed piece of the answer to the chat as it arrives."""
+        if handle is not None and handle is not self._query_handle:
+            return  # Chunk from a cancelled query
+        self.result_textbox.configure(state="normal")
+        if not self._stream_started:
+            self._stream_started = True
+            self.progress_bar.stop()
+            self.progress_bar.grid_forget()
+            self.result_textbox.insert("end", "AI\n", "ai_label")
+        self.result_textbox.insert("end", chunk, "ai_msg")
+        self.result_textbox.configure(state="disabled")
+        self.result_textbox.see("end")
 
-    def show_result(self, text, is_error=False):
+    def show_result(self, text, is_error=False, handle=None, speak=True):
+        if handle is not None and handle is not self._query_handle:
+            return  # Result of a cancelled query
+        self._query_handle = None
         self.progress_bar.stop()
         self.progress_bar.grid_forget()
 
@@ -815,22 +1253,48 @@ class OverlayApp(ctk.CTk):
 
         self.display_chat()
 
+        self.accept_btn.pack_forget()
         if is_error:
             self.retry_btn.pack(pady=5)
         else:
             self.retry_btn.pack_forget()
 
         self.entry.configure(state="normal")
-        self.send_btn.configure(state="normal", text="↑")
+        self.send_btn.configure(state="normal", text="↑", command=self.on_submit)
         self.entry.focus_set()
         # Clear entry to allow follow-up question
         if not is_error:
             self.entry.delete(0, 'end')
 
         # Play TTS if enabled and not an error
-        if not is_error and settings_manager.get_tts_enabled():
+        if speak and not is_error and settings_manager.get_tts_enabled():
             self._play_tts(text)
 
+    def _poll_offline_queue(self, reschedule=True):
+        """Show the offline queue's depth and age, and pick up delivered answers."""
+        depth, age = offline_queue.status()
+        if depth:
+            if age < 60:
+                age_text = f"{age:.0f}s"
+            elif age < 3600:
+                age_text = f"{age / 60:.0f}m"
+            else:
+                age_text = f"{age / 3600:.0f}h"
+            self.queue_label.configure(text=f"📤 {depth} queued · oldest {age_text}")
+            self.queue_label.grid(row=0, column=1, sticky="e", padx=(0, 8))
+        else:
+            self.queue_label.grid_forget()
+
+        # Refresh the open chat when one of its queued questions was answered
+        if self._query_handle is None and self.current_session_id in offline_queue.pop_delivered():
+            self.chat_messages, self.chat_cursor = settings_manager.get_session_messages_page(
+                self.current_session_id
+            )
+            self.display_chat()
+
+        if reschedule:
+            self.after(config.QUEUE_STATUS_INTERVAL, self._poll_offline_queue)
+
     def _play_tts(self, text):
         """Play text-to-speech for the given text."""
         voice = settings_manager.get_tts_voice()
@@ -854,6 +1318,23 @@ class OverlayApp(ctk.CTk):
         """Stop any ongoing TTS playback."""
         tts_utils.stop()
 
+    def _chat_segments(self, messages):
+        """Build (text, tag) pairs for rendering messages in the chat textbox."""
+        segments = []
+        if self.chat_cursor is not None:
+            segments.append(("Scroll up for earlier messages\n\n", "more_label"))
+        for msg in messages:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+
+            if role == "user":
+                segments.append(("You\n", "user_label"))
+                segments.append((f"{content}\n\n", "user_msg"))
+            else:
+                segments.append(("AI\n", "ai_label"))
+                segments.append((f"{content}\n\n", "ai_msg"))
+        return segments
+
     def display_chat(self):
         """Display the full chat conversation."""
         # Show chat frame in row 1 (between header and input)
@@ -862,18 +1343,11 @@ class OverlayApp(ctk.CTk):
         self.result_textbox.configure(state="normal")
         self.result_textbox.delete("0.0", "end")
 
-        for msg in self.chat_messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-
-            if role == "user":
-                self.result_textbox.insert("end", "You\n", "user_label")
-                self.result_textbox.insert("end", f"{content}\n\n", "user_msg")
-            else:
-                self.result_textbox.insert("end", "AI\n", "ai_label")
-                self.result_textbox.insert("end", f"{content}\n\n", "ai_msg")
+        for text, tag in self._chat_segments(self.chat_messages):
+            self.result_textbox.insert("end", text, tag)
 
         # Configure tags for styling (CTkTextbox doesn't allow font in tag_config)
+        self.result_textbox.tag_config("more_label", foreground="gray")
         self.result_textbox.tag_config("user_label", foreground="#3b82f6")
         self.result_textbox.tag_config("ai_label", foreground="#10b981")
         self.result_textbox.tag_config("user_msg", foreground="#e5e5e5")
@@ -883,6 +1357,35 @@ class OverlayApp(ctk.CTk):
         # Scroll to bottom
         self.result_textbox.see("end")
 
+    def _on_chat_scroll(self, event=None):
+        """Check (after the scroll is applied) whether earlier messages are needed."""
+        if self.chat_cursor is not None:
+            self.after(50, self._load_earlier_messages)
+
+    def _load_earlier_messages(self):
+        """Prepend the previous page of the current session when scrolled to the top."""
+        if self.chat_cursor is None or not self.current_session_id:
+            return
+        if self.result_textbox.yview()[0] > 0:
+            return
+
+        earlier, self.chat_cursor = settings_manager.get_session_messages_page(
+            self.current_session_id, before=self.chat_cursor
+        )
+        self.chat_messages = earlier + self.chat_messages
+
+        self.result_textbox.configure(state="normal")
+        # Drop the old "scroll up" hint, then insert the new page above the old top
+        self.result_textbox.delete("1.0", "3.0")
+        segments = self._chat_segments(earlier)
+        for text, tag in reversed(segments):
+            self.result_textbox.insert("1.0", text, tag)
+        self.result_textbox.configure(state="disabled")
+
+        # Keep the message the user was looking at in place
+        inserted_lines = sum(text.count("\n") for text, _ in segments)
+        self.result_textbox.yview(f"{inserted_lines + 1}.0")
+
     def open_settings(self):
         if self.settings_window is not None and self.settings_window.winfo_exists():
             self.settings_window.destroy()
@@ -911,6 +1414,14 @@ class OverlayApp(ctk.CTk):
         url_entry.insert(0, settings_manager.get_webhook_url())
         url_entry.pack(fill="x", pady=(0, 10))
 
+        # Race mode
+        race_mode_var = ctk.BooleanVar(value=settings_manager.get_race_mode())
+        ctk.CTkSwitch(
+            content,
+            text="Race mode (show a quick Low answer while Mid/High works)",
+            variable=race_mode_var
+        ).pack(fill="x", pady=(0, 10))
+
         # Voice Mode
         ctk.CTkLabel(content, text="Voice Mode:", anchor="w").pack(fill="x", pady=(10, 5))
         voice_mode_var = ctk.StringVar(value=settings_manager.get_voice_mode())
@@ -994,6 +1505,7 @@ class OverlayApp(ctk.CTk):
             settings_manager.set_webhook_url(new_url)
             settings_manager.set_voice_mode(new_voice_mode)
             settings_manager.set_voice_hotkey(new_voice_hotkey)
+            settings_manager.set_race_mode(race_mode_var.get())
 
             # Save TTS settings
             settings_manager.set_tts_enabled(tts_enabled_var.get())
@@ -1123,12 +1635,122 @@ class OverlayApp(ctk.CTk):
             
         self.history_window.attributes("-topmost", True)
         self.history_window.protocol("WM_DELETE_WINDOW", self.close_history)
-        
-        sessions = settings_manager.get_sessions()
+
+        # Search box (full-text search over all messages)
+        search_entry = ctk.CTkEntry(
+            self.history_window, placeholder_text='Search ("phrase", prefix*) - Enter includes archive',
+            height=30, font=("Arial", 12)
+        )
+        search_entry.pack(fill="x", padx=10, pady=(10, 0))
         
         scrollable_frame = ctk.CTkScrollableFrame(self.history_window)
         scrollable_frame.pack(fill="both", expand=True, padx=10, pady=10)
-        
+
+        self._history_search_after_id = None
+        self._history_search = None
+        search_entry.bind(
+            "<KeyRelease>",
+            lambda e: self._schedule_history_search(search_entry, scrollable_frame)
+        )
+        # Enter also searches the compressed archive (slower, so not on every key)
+        search_entry.bind(
+            "<Return>",
+            lambda e: self._run_history_search(search_entry.get(), scrollable_frame, True)
+        )
+
+        self._history_offset = 0
+        self._history_more_btn = None
+        self._add_history_page(scrollable_frame)
+
+    def _schedule_history_search(self, search_entry, scrollable_frame):
+        """Debounce search-as-you-type in the History window."""
+        if self._history_search_after_id:
+            self.after_cancel(self._history_search_after_id)
+        self._history_search_after_id = self.after(
+            200, lambda: self._run_history_search(search_entry.get(), scrollable_frame)
+        )
+
+    def _run_history_search(self, text, scrollable_frame, include_archive=False):
+        """Replace the History list with search results (or the session list if empty)."""
+        if self._history_search_after_id:
+            self.after_cancel(self._history_search_after_id)
+        self._history_search_after_id = None
+        if self._history_search is not None:
+            self._history_search.cancel()
+            self._history_search = None
+        if not scrollable_frame.winfo_exists():
+            return
+
+        if not text.strip():
+            for child in scrollable_frame.winfo_children():
+                child.destroy()
+            self._history_more_btn = None
+            self._history_offset = 0
+            self._add_history_page(scrollable_frame)
+            return
+
+        # Searching (especially the archive) can take a while on a big
+        # history, so it runs on the search thread; the current list stays
+        # up until the results arrive
+        self._history_search = _search_executor.submit(
+            settings_manager.search_history, text, include_archive
+        )
+        self._poll_history_search(self._history_search, scrollable_frame)
+
+    def _poll_history_search(self, future, scrollable_frame):
+        if future is not self._history_search or not scrollable_frame.winfo_exists():
+            return
+        if not future.done():
+            self.after(config.QUERY_POLL_INTERVAL, self._poll_history_search, future, scrollable_frame)
+            return
+        self._history_search = None
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Error searching history: {e}")
+            results = []
+        self._show_history_results(results, scrollable_frame)
+
+    def _show_history_results(self, results, scrollable_frame):
+        for child in scrollable_frame.winfo_children():
+            child.destroy()
+        self._history_more_btn = None
+
+        if not results:
+            ctk.CTkLabel(scrollable_frame, text="No matches", text_color="gray").pack(pady=10)
+            return
+
+        for result in results:
+            sid = result["session_id"]
+            snippet = " ".join(result["snippet"].split())
+            prefix = "You" if result["role"] == "user" else "AI"
+            archived = result.get("archived", False)
+            btn = ctk.CTkButton(
+                scrollable_frame,
+                text=f"{'[archived] ' if archived else ''}{result['title'][:35]}\n{prefix}: {snippet[:60]}",
+                command=lambda s=sid, a=archived: self._open_search_result(s, a),
+                anchor="w",
+                fg_color="transparent",
+                border_width=1,
+                text_color=("gray10", "gray90")
+            )
+            btn.pack(fill="x", pady=2, padx=2)
+
+    def _open_search_result(self, session_id, archived):
+        """Open a search result, restoring it from the archive first if needed."""
+        if archived:
+            settings_manager.restore_archived_session(session_id)
+        self.load_session(session_id, self.history_window)
+
+    def _add_history_page(self, scrollable_frame):
+        """Append the next page of session summaries to the History list."""
+        if self._history_more_btn is not None:
+            self._history_more_btn.destroy()
+            self._history_more_btn = None
+
+        sessions = settings_manager.get_session_index(config.HISTORY_PAGE_SIZE, self._history_offset)
+        self._history_offset += len(sessions)
+
         for session in sessions:
             title = session.get("title", "Untitled")
             sid = session.get("id")
@@ -1147,6 +1769,12 @@ class OverlayApp(ctk.CTk):
                 text_color=("gray10", "gray90")
             )
             btn.pack(side="left", fill="x", expand=True, padx=2)
+
+            # Message count
+            ctk.CTkLabel(
+                row_frame, text=str(session.get("message_count", 0)),
+                width=30, font=("Arial", 10), text_color="gray"
+            ).pack(side="left", padx=2)
             
             # Delete Button
             del_btn = ctk.CTkButton(
@@ -1158,6 +1786,15 @@ class OverlayApp(ctk.CTk):
             )
             del_btn.pack(side="right", padx=2)
 
+        if len(sessions) == config.HISTORY_PAGE_SIZE:
+            self._history_more_btn = ctk.CTkButton(
+                scrollable_frame, text="Show more", height=24,
+                font=("Arial", 11), fg_color="transparent", border_width=1,
+                border_color="#444", hover_color="#333",
+                command=lambda: self._add_history_page(scrollable_frame)
+            )
+            self._history_more_btn.pack(fill="x", pady=(6, 2))
+
     def close_history(self):
         if self.history_window:
             # Save position before closing
@@ -1168,7 +1805,9 @@ class OverlayApp(ctk.CTk):
     def load_session(self, session_id, history_window=None):
         """Load a previous session and display its messages."""
         self.current_session_id = session_id
-        self.chat_messages = settings_manager.get_session_messages(session_id)
+        self._last_request = None
+        # Only the latest turns are loaded; earlier ones load on scroll-up
+        self.chat_messages, self.chat_cursor = settings_manager.get_session_messages_page(session_id)
         self.display_chat()
         self.entry.delete(0, 'end')
         self.entry.focus_set()
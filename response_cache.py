@@ -0,0 +1,108 @@
+"""
+Local cache of webhook answers.
+
+Answers are keyed by the normalised query text, a hash of the screenshot,
+the complexity, the response format and the chat session, so asking the same
+question about the same screen again is answered instantly. The session is
+part of the key because the webhook's answer can depend on the conversation
+so far. Entries expire after a TTL and
+the least recently used ones are evicted past the size limit. The cache is
+kept in memory and mirrored to CACHE_FILE so it survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_FILE = "response_cache.json"
+
+_lock = threading.Lock()
+_entries = None  # OrderedDict key -> {"response", "ts"}, least recently used first
+
+
+def normalize_query(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = " ".join(text.lower().split())
+    return re.sub(r"[\s?!.]+$", "", text)
+
+
+def make_key(text, image_bytes, complexity, response_format, session_id=None):
+    screenshot_hash = hashlib.sha256(image_bytes).hexdigest() if image_bytes else ""
+    raw = json.dumps([normalize_query(text), screenshot_hash, complexity, response_format,
+                      session_id or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _load():
+    global _entries
+    if _entries is not None:
+        return _entries
+    _entries = OrderedDict()
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        # Stored oldest first, so the LRU order is kept
+        for key, entry in stored:
+            _entries[key] = entry
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading response cache: {e}")
+    return _entries
+
+
+def _save(entries):
+    tmp_path = CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(entries.items()), f)
+        os.replace(tmp_path, CACHE_FILE)
+    except Exception as e:
+        print(f"Error saving response cache: {e}")
+
+
+def _prune(entries, max_entries, ttl, now):
+    expired = [k for k, e in entries.items() if now - e["ts"] > ttl]
+    for key in expired:
+        del entries[key]
+    while len(entries) > max_entries:
+        entries.popitem(last=False)
+
+
+def get(key, ttl):
+    """Return the cached response for key, or None if missing or expired."""
+    with _lock:
+        entries = _load()
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["ts"] > ttl:
+            del entries[key]
+            _save(entries)
+            return None
+        entries.move_to_end(key)
+        return entry["response"]
+
+
+def put(key, response, max_entries, ttl):
+    with _lock:
+        entries = _load()
+        entries[key] = {"response": response, "ts": time.time()}
+        entries.move_to_end(key)
+        _prune(entries, max_entries, ttl, time.time())
+        _save(entries)
+
+
+def clear():
+    """Drop every cached response."""
+    global _entries
+    with _lock:
+        _entries = OrderedDict()
+        try:
+            os.remove(CACHE_FILE)
+        except FileNotFoundError:
+            pass
@@ -1,16 +1,105 @@
+import hashlib
 import mss
 import mss.tools
-from PIL import Image
+import numpy as np
+from PIL import Image, features
 import io
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
-def get_monitors():
+# Seconds a caller waits for the capture thread before giving up
+CAPTURE_TIMEOUT = 10
+
+# Rows processed at a time when halving a grab (bounds temporary memory)
+HALVE_BAND_ROWS = 128
+
+# Background encoding for pre-captured screenshots
+_encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-encoder")
+
+
+class CaptureEngine:
     """
-    Returns a list of available monitors with their info.
-    Returns: [(index, name, bounds), ...]
+    Long-lived screen capture engine.
+
+    Keeps one mss handle (display connection and grab buffers) open on a
+    dedicated capture thread instead of opening one per screenshot; mss
+    handles must stay on the thread that created them, so any thread can
+    call grab()/monitors() and the work is handed to the capture thread.
+    If a request fails, e.g. after a display was unplugged or changed
+    resolution, the handle is reopened and the request tried once more.
     """
-    with mss.mss() as sct:
+
+    def __init__(self, factory=mss.mss):
+        self._factory = factory
+        self._requests = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._sct = None  # only touched on the capture thread
+        self._monitors = None
+
+    def _call(self, func, *args):
+        """Run func(*args) on the capture thread and return its result."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="screen-capture", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._requests.put((func, args, future))
+        return future.result(CAPTURE_TIMEOUT)
+
+    def _run(self):
+        while True:
+            func, args, future = self._requests.get()
+            if func is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self._sct is None:
+                    self._sct = self._factory()
+                result = func(*args)
+            except Exception as e:
+                print(f"Screen capture failed ({e}); reconnecting")
+                try:
+                    self._reconnect()
+                    result = func(*args)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(result)
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._sct is not None:
+            try:
+                self._sct.close()
+            except Exception:
+                pass
+            self._sct = None
+
+    def _reconnect(self):
+        self._disconnect()
+        self._sct = self._factory()
+        self._monitors = self._read_monitors()
+
+    def _reread_layout(self):
+        """Ask the OS for the monitor layout again, keeping the open handle."""
+        # mss caches the layout per handle; clearing the cache makes the next
+        # read enumerate the monitors again. Newer mss marks "not read yet"
+        # with None, older versions with an empty list.
+        for empty in (None, []):
+            self._sct._monitors = empty
+            try:
+                if self._sct.monitors:
+                    break
+            except (AttributeError, TypeError):
+                continue
+        return self._read_monitors()
+
+    def _read_monitors(self):
         monitors = []
-        for i, mon in enumerate(sct.monitors):
+        for i, mon in enumerate(self._sct.monitors):
             if i == 0:  # Skip "all monitors" entry
                 continue
             name = f"Screen {i}"
@@ -24,40 +113,391 @@ def get_monitors():
             })
         return monitors
 
-def capture_screen(monitor_index=1):
-    """
-    Captures the specified screen and returns it as a PIL Image.
-    """
-    with mss.mss() as sct:
+    def _grab(self, monitor_index):
+        monitors = self._sct.monitors
         # Ensure valid monitor index
-        if monitor_index < 1 or monitor_index >= len(sct.monitors):
+        if monitor_index < 1 or monitor_index >= len(monitors):
             monitor_index = 1
-        
-        monitor = sct.monitors[monitor_index]
-        sct_img = sct.grab(monitor)
-        
-        # Convert to PIL Image
-        img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+        return self._sct.grab(monitors[monitor_index])
+
+    def monitors(self):
+        """Return the cached monitor layout (see get_monitors)."""
+        monitors = self._monitors
+        if monitors is None:
+            monitors = self._call(self._read_monitors)
+            self._monitors = monitors
+        return monitors
+
+    def refresh(self):
+        """
+        Re-read the monitor layout and return it. The handle is only
+        reopened when the layout changed, so the grab buffers of the new
+        layout start fresh; a failed read reconnects as any request does.
+        """
+        def refresh():
+            monitors = self._reread_layout()
+            if self._monitors is not None and monitors != self._monitors:
+                self._reconnect()
+            else:
+                self._monitors = monitors
+            return self._monitors
+        return self._call(refresh)
+
+    def grab(self, monitor_index=1):
+        """Grab a monitor and return the mss ScreenShot (raw BGRA pixels)."""
+        return self._call(self._grab, monitor_index)
+
+    def close(self):
+        """Stop the capture thread and release the mss handle."""
+        with self._lock:
+            if self._thread is not None:
+                self._requests.put((None, (), None))
+                self._thread = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Return the shared CaptureEngine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = CaptureEngine()
+        return _engine
+
+def refresh_monitors():
+    """Re-read the monitor layout and return it (see get_monitors)."""
+    return get_engine().refresh()
+
+def get_monitors():
+    """
+    Returns a list of available monitors with their info.
+    Returns: [(index, name, bounds), ...]
+
+    The layout is cached; call refresh_monitors() to pick up changes.
+    """
+    return get_engine().monitors()
+
+def _average(a, b):
+    """Per-byte average (rounded down) of two uint32 arrays of packed BGRA pixels."""
+    result = a ^ b
+    result &= 0xFEFEFEFE
+    result >>= 1
+    result += a & b
+    return result
+
+def _halve(pixels):
+    """Average 2x2 blocks of a (h, w) uint32 pixel array, a band of rows at a time."""
+    height, width = pixels.shape[0] // 2, pixels.shape[1] // 2
+    out = np.empty((height, width), dtype=np.uint32)
+    for start in range(0, height, HALVE_BAND_ROWS):
+        stop = min(height, start + HALVE_BAND_ROWS)
+        rows = _average(pixels[2 * start:2 * stop:2, :2 * width],
+                        pixels[2 * start + 1:2 * stop:2, :2 * width])
+        out[start:stop] = _average(rows[:, 0::2], rows[:, 1::2])
+    return out
+
+def frame_to_image(sct_img, crop=None, max_edge=0):
+    """
+    Convert a grab to an RGB PIL Image.
+
+    Cropping and downscaling are done on the raw BGRA buffer before any PIL
+    object exists, and the BGRA -> RGB conversion happens while Pillow reads
+    the pixels, so no full-frame copy is made beyond the output image.
+
+    Args:
+        crop (tuple): Optional (left, top, right, bottom) in grab pixels.
+        max_edge (int): Downscale so the long edge is at most this (0 = keep size).
+    """
+    width, height = sct_img.size
+    left, top, right, bottom = crop or (0, 0, width, height)
+    left, top = max(0, left), max(0, top)
+    right, bottom = min(width, right), min(height, bottom)
+    if right <= left or bottom <= top:
+        raise ValueError(f"empty crop {crop} for a {width}x{height} grab")
+
+    if max_edge and max(right - left, bottom - top) >= 2 * max_edge:
+        # Halve in NumPy while at least twice too big; Pillow does the rest
+        pixels = np.frombuffer(sct_img.raw, dtype=np.uint32).reshape(height, width)[top:bottom, left:right]
+        while max(pixels.shape) >= 2 * max_edge and min(pixels.shape) >= 2:
+            pixels = _halve(pixels)
+        size = (pixels.shape[1], pixels.shape[0])
+        buffer, stride = pixels, pixels.shape[1] * 4
+    else:
+        # Read the crop straight out of the grab via a row stride
+        size = (right - left, bottom - top)
+        stride = width * 4
+        buffer = memoryview(sct_img.raw)[top * stride + left * 4:]
+
+    img = Image.frombuffer("RGB", size, buffer, "raw", "BGRX", stride, 1)
+    return _downscale(img, max_edge)
+
+def capture_screen(monitor_index=1, crop=None, max_edge=0):
+    """
+    Captures the specified screen and returns it as a PIL Image, optionally
+    cropped and downscaled (see frame_to_image).
+    """
+    sct_img = get_engine().grab(monitor_index)
+
+    # Convert to PIL Image (on the caller's thread, keeping the capture thread free)
+    return frame_to_image(sct_img, crop, max_edge)
+
+# Image formats the encoder can produce: format -> (PIL format, MIME type, extension)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+
+# Lowest quality tried when shrinking a JPEG/WebP to fit max_bytes
+MIN_BUDGET_QUALITY = 30
+
+# Quality steps tried when searching for the best quality under max_bytes
+BUDGET_SEARCH_STEPS = 4
+
+
+class EncodedImage(bytes):
+    """
+    Encoded screenshot bytes that remember their MIME type. unchanged marks
+    a screen that looks the same as the last one sent in the session: the
+    bytes are then a thumbnail, or empty to send only the marker. A screen
+    delta holds several region images back to back.
+    """
+
+    def __new__(cls, data, mime_type="image/png", unchanged=False, regions=None,
+                full_frame=None):
+        image = super().__new__(cls, data)
+        image.mime_type = mime_type
+        image.unchanged = unchanged
+        # For a screen delta (see encode_delta): where each region goes and
+        # which bytes hold it
+        image.regions = regions
+        # For a thumbnail, marker or delta: the encoded full screenshot it
+        # stands in for (the response cache is keyed on that)
+        image.full_frame = full_frame
+        return image
+
+    @property
+    def filename(self):
+        for _, mime_type, extension in IMAGE_FORMATS.values():
+            if mime_type == self.mime_type:
+                return f"screenshot.{extension}"
+        return "screenshot"
+
+
+def _downscale(img, max_edge):
+    """Shrink img so its long edge is at most max_edge (0 = no limit)."""
+    long_edge = max(img.size)
+    if not max_edge or long_edge <= max_edge:
         return img
+    scale = max_edge / long_edge
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    # reducing_gap lets Pillow box-reduce first, which is much faster on big screens
+    return img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+def _save(img, pil_format, quality):
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(buffer, format="PNG", compress_level=1 if quality < 50 else 6)
+    elif pil_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=quality, method=0)
+    else:
+        img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def encode_image(img, image_format="png", quality=85, max_edge=0, max_bytes=0):
+    """
+    Encode a PIL Image for upload.
+
+    Args:
+        image_format (str): "png", "jpeg" or "webp" (WebP falls back to JPEG if
+            this Pillow build lacks it).
+        quality (int): 1-100; for PNG, below 50 trades size for speed.
+        max_edge (int): Downscale so the long edge is at most this (0 = keep size).
+        max_bytes (int): Byte budget to aim for (0 = none). Quality is lowered
+            first (JPEG/WebP), then the image is downscaled further.
+
+    Returns:
+        EncodedImage: The bytes, with mime_type and filename set.
+    """
+    image_format = image_format.lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in IMAGE_FORMATS:
+        print(f"Unknown screenshot format '{image_format}', using PNG")
+        image_format = "png"
+    if image_format == "webp" and not features.check("webp"):
+        print("WebP is not supported by this Pillow build, using JPEG")
+        image_format = "jpeg"
+    pil_format, mime_type, _ = IMAGE_FORMATS[image_format]
+
+    img = _downscale(img, max_edge)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    data = _save(img, pil_format, quality)
+
+    if max_bytes and len(data) > max_bytes:
+        if pil_format != "PNG" and quality > MIN_BUDGET_QUALITY:
+            lowest = _save(img, pil_format, MIN_BUDGET_QUALITY)
+            if len(lowest) <= max_bytes:
+                # Highest quality that fits; a few steps are close enough
+                data, low, high = lowest, MIN_BUDGET_QUALITY + 1, quality - 1
+                for _ in range(BUDGET_SEARCH_STEPS):
+                    if low > high:
+                        break
+                    q = (low + high) // 2
+                    candidate = _save(img, pil_format, q)
+                    if len(candidate) <= max_bytes:
+                        data, low = candidate, q + 1
+                    else:
+                        high = q - 1
+            else:
+                quality, data = MIN_BUDGET_QUALITY, lowest
+        # Still too big: downscale by the size ratio until it fits (or gets tiny)
+        while len(data) > max_bytes and max(img.size) > 64:
+            scale = max(0.5, min(0.9, 0.95 * (max_bytes / len(data)) ** 0.5))
+            img = _downscale(img, int(max(img.size) * scale))
+            data = _save(img, pil_format, quality)
+
+    return EncodedImage(data, mime_type)
+
+def capture_screen_bytes(monitor_index=1, **options):
+    """
+    Captures the screen and returns the encoded image bytes (PNG unless
+    options for encode_image say otherwise).
+    """
+    img = capture_screen(monitor_index, max_edge=options.get("max_edge", 0))
+    return encode_image(img, **options)
+
+def encode_image_async(img, **options):
+    """Encode img on a background thread. Returns a Future for the EncodedImage."""
+    return _encoder.submit(encode_image, img, **options)
+
+# A fingerprint is the mean brightness of each block in a FINGERPRINT_GRID square grid
+FINGERPRINT_GRID = 64
+
+# A block counts as changed when its mean brightness moves by more than this
+# (0-255); a typed word is caught, a few stray pixels are not
+FINGERPRINT_TOLERANCE = 2
+
+def fingerprint(img):
+    """Block hash of a PIL Image for spotting screen changes (bytes)."""
+    # Box-reducing first keeps this fast on large screens
+    factor = min(img.width, img.height) // (FINGERPRINT_GRID * 4)
+    if factor >= 2:
+        img = img.reduce(factor)
+    grid = img.resize((FINGERPRINT_GRID, FINGERPRINT_GRID), Image.Resampling.BOX)
+    return grid.convert("L").tobytes()
 
-def capture_screen_bytes(monitor_index=1):
+def screen_change(previous, current):
+    """Fraction (0-1) of blocks that differ between two fingerprints."""
+    if previous is None or len(previous) != len(current):
+        return 1.0
+    diff = np.abs(np.frombuffer(previous, dtype=np.uint8).astype(np.int16)
+                  - np.frombuffer(current, dtype=np.uint8))
+    return np.count_nonzero(diff > FINGERPRINT_TOLERANCE) / len(current)
+
+# Screen deltas compare screenshots in DELTA_TILE_SIZE x DELTA_TILE_SIZE pixel tiles
+DELTA_TILE_SIZE = 64
+
+# Deltas with more changed regions than this are sent as a full frame
+DELTA_MAX_REGIONS = 16
+
+def tile_hashes(img):
+    """Return (size, [digest of each DELTA_TILE_SIZE tile, row by row]) for a PIL Image."""
+    pixels = np.asarray(img)
+    digests = []
+    for top in range(0, img.height, DELTA_TILE_SIZE):
+        band = pixels[top:top + DELTA_TILE_SIZE]
+        for left in range(0, img.width, DELTA_TILE_SIZE):
+            tile = band[:, left:left + DELTA_TILE_SIZE]
+            digests.append(hashlib.blake2b(tile.tobytes(), digest_size=16).digest())
+    return img.size, digests
+
+def dirty_regions(previous, current):
     """
-    Captures the screen and returns the image bytes (PNG format).
+    Compare two tile_hashes() results.
+
+    Returns:
+        tuple: ([(left, top, right, bottom), ...] covering the changed tiles,
+        fraction of tiles that changed), or (None, 1.0) if there is nothing
+        to compare with or the screen size changed.
     """
-    img = capture_screen(monitor_index)
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG')
-    return img_byte_arr.getvalue()
+    (width, height), digests = current
+    if previous is None or previous[0] != (width, height):
+        return None, 1.0
+    columns = -(-width // DELTA_TILE_SIZE)
+    changed = 0
+    regions = []
+    open_runs = {}  # (first column, end column) -> top row of a region still growing
+    for row in range(len(digests) // columns + 1):
+        runs = []
+        if row < len(digests) // columns:
+            start = None
+            for column in range(columns + 1):
+                i = row * columns + column
+                dirty = column < columns and digests[i] != previous[1][i]
+                changed += dirty
+                if dirty and start is None:
+                    start = column
+                elif not dirty and start is not None:
+                    runs.append((start, column))
+                    start = None
+        # Runs spanning the same columns as in the row above extend that region
+        next_runs = {}
+        for run in runs:
+            next_runs[run] = open_runs.pop(run, row)
+        for (first, end), top in open_runs.items():
+            regions.append((first * DELTA_TILE_SIZE, top * DELTA_TILE_SIZE,
+                            min(width, end * DELTA_TILE_SIZE), min(height, row * DELTA_TILE_SIZE)))
+        open_runs = next_runs
+    return regions, changed / len(digests)
+
+def encode_delta(img, regions, image_format="png", quality=85):
+    """
+    Encode the given regions of img as one EncodedImage: the region images
+    back to back, with .regions giving each one's position and byte range.
+    """
+    parts, layout, offset = [], [], 0
+    for left, top, right, bottom in regions:
+        part = encode_image(img.crop((left, top, right, bottom)), image_format, quality)
+        layout.append({"x": left, "y": top, "width": right - left, "height": bottom - top,
+                       "offset": offset, "length": len(part)})
+        parts.append(part)
+        offset += len(part)
+    return EncodedImage(b"".join(parts), parts[0].mime_type,
+                        regions={"screen": list(img.size), "regions": layout})
+
+def screen_delta(img, previous, image_format="png", quality=85, max_changed=1.0):
+    """
+    Work out the delta to send for img, given the tile_hashes() of the
+    screenshot sent before it.
+
+    Returns:
+        tuple: (tile hashes of img, encoded delta), where the delta is None
+        when img should be sent whole: nothing to compare with, nothing
+        changed, more than max_changed of the tiles changed or too many
+        regions.
+    """
+    tiles = tile_hashes(img)
+    regions, changed = dirty_regions(previous, tiles)
+    if not regions or changed > max_changed or len(regions) > DELTA_MAX_REGIONS:
+        return tiles, None
+    return tiles, encode_delta(img, regions, image_format, quality)
+
+def screen_delta_async(img, previous, **options):
+    """Run screen_delta on the encoder thread. Returns a Future for its result."""
+    return _encoder.submit(screen_delta, img, previous, **options)
 
 def get_monitor_bounds(monitor_index):
     """Get the bounds of a specific monitor."""
-    with mss.mss() as sct:
-        if monitor_index < 1 or monitor_index >= len(sct.monitors):
-            return None
-        mon = sct.monitors[monitor_index]
-        return {
-            "left": mon["left"],
-            "top": mon["top"],
-            "width": mon["width"],
-            "height": mon["height"]
-        }
+    for mon in get_monitors():
+        if mon["index"] == monitor_index:
+            return {
+                "left": mon["left"],
+                "top": mon["top"],
+                "width": mon["width"],
+                "height": mon["height"]
+            }
+    return None
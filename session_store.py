@@ -0,0 +1,473 @@
+"""
+Chat session storage backed by SQLite.
+
+Sessions used to live inside settings.json, which meant every answer
+rewrote the whole history. Here each turn is a couple of row inserts.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+DB_FILE = "sessions.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_timestamp ON sessions(timestamp);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+"""
+
+# Full-text index over message content. Kept in sync by triggers, so every
+# append_interaction updates it incrementally. The 2- and 3-character prefix
+# indexes keep search-as-you-type fast for short prefixes.
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Ids of journal entries already written here, so replaying the
+# interaction journal after a crash never duplicates a turn
+_JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS applied_entries (
+    id TEXT PRIMARY KEY
+);
+"""
+
+# Bumped whenever an existing database needs upgrading (PRAGMA user_version)
+SCHEMA_VERSION = 4
+
+SEARCH_LIMIT = 50
+
+# The last word typed is only searched as a prefix once it is this long; a
+# one-letter prefix matches most of the index
+PREFIX_MIN_LENGTH = 2
+
+# Each thread gets its own connection. With WAL, readers never wait for a
+# writer; writes are serialised through _write_lock and bump _version.
+_write_lock = threading.RLock()
+_init_lock = threading.Lock()
+_local = threading.local()
+_connections = []
+_generation = 0
+_migrated = False
+_version = 0
+
+
+def _connect():
+    """Return this thread's connection, opening and initialising it on first use."""
+    global _migrated
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.generation == _generation:
+        return conn
+
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    # Writers call this while holding _write_lock, so only _init_lock is
+    # taken here. Every thread opens its connection through this lock, so
+    # nothing else in the process touches the database during _migrate.
+    with _init_lock:
+        if not _migrated:
+            _migrate(conn)
+            _migrated = True
+        _connections.append(conn)
+        _local.conn = conn
+        _local.generation = _generation
+    return conn
+
+
+def _bump_version():
+    global _version
+    _version += 1
+
+
+def get_version():
+    """Monotonic counter that changes whenever stored sessions change."""
+    return _version
+
+
+def _migrate(conn):
+    """Bring an existing database up to SCHEMA_VERSION."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    conn.executescript(_SCHEMA)
+    with conn:
+        if version < 1:
+            # v1: per-session message counts for the history index
+            columns = [r["name"] for r in conn.execute("PRAGMA table_info(sessions)")]
+            if "message_count" not in columns:
+                conn.execute(
+                    "ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0"
+                )
+                conn.execute(
+                    "UPDATE sessions SET message_count = "
+                    "(SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.id)"
+                )
+        if version < 2:
+            # v2: full-text search index, built once from existing messages
+            try:
+                conn.executescript(_FTS_SCHEMA)
+                conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError as e:
+                # SQLite built without FTS5; search falls back to LIKE
+                print(f"Full-text search unavailable: {e}")
+        if version < 3:
+            # v3: interaction journal bookkeeping
+            conn.executescript(_JOURNAL_SCHEMA)
+        if 2 <= version < 4 and _has_fts(conn):
+            # v4: rebuild the search index with prefix indexes (new databases
+            # already got them in the v2 step)
+            conn.executescript(
+                "DROP TRIGGER IF EXISTS messages_fts_insert;"
+                "DROP TRIGGER IF EXISTS messages_fts_delete;"
+                "DROP TABLE messages_fts;"
+            )
+            conn.executescript(_FTS_SCHEMA)
+            conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def close():
+    """Close all database connections (reopened lazily on next use)."""
+    global _generation, _migrated
+    with _init_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+        _generation += 1
+        _migrated = False
+
+
+def create_session(session_id, title="New Chat", timestamp=None):
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, title, timestamp) VALUES (?, ?, ?)",
+                (session_id, title, timestamp or time.time())
+            )
+        _bump_version()
+
+
+def _append_turn(conn, session_id, query, response, now):
+    row = conn.execute(
+        "SELECT title, EXISTS(SELECT 1 FROM messages WHERE session_id = ?) AS has_messages "
+        "FROM sessions WHERE id = ?",
+        (session_id, session_id)
+    ).fetchone()
+
+    if row is None:
+        # Should not happen if flow is correct, but safe fallback
+        conn.execute(
+            "INSERT INTO sessions (id, title, timestamp) VALUES (?, ?, ?)",
+            (session_id, query[:30] + "...", now)
+        )
+    elif not row["has_messages"] or row["title"] == "New Chat":
+        # Update title if it's the first real message
+        conn.execute(
+            "UPDATE sessions SET title = ? WHERE id = ?",
+            (query[:30] + "...", session_id)
+        )
+
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+        [(session_id, "user", query), (session_id, "assistant", response)]
+    )
+    # Update timestamp to move to top
+    conn.execute(
+        "UPDATE sessions SET timestamp = ?, message_count = message_count + 2 WHERE id = ?",
+        (now, session_id)
+    )
+
+
+def append_interaction(session_id, query, response):
+    """Append a user/assistant turn to a session, creating it if needed."""
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            _append_turn(conn, session_id, query, response, time.time())
+        _bump_version()
+
+
+def append_interactions(entries):
+    """
+    Append a batch of journal entries ({id, session_id, query, response}) in
+    one transaction. Entries whose id was already applied are skipped.
+    """
+    now = time.time()
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            for entry in entries:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO applied_entries (id) VALUES (?)", (entry["id"],)
+                )
+                if cur.rowcount == 0:
+                    continue
+                _append_turn(conn, entry["session_id"], entry["query"], entry["response"], now)
+        _bump_version()
+
+
+def clear_applied_entries():
+    """Forget applied journal ids once the journal no longer contains them."""
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            conn.execute("DELETE FROM applied_entries")
+
+
+def get_messages(session_id):
+    rows = _connect().execute(
+        "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id",
+        (session_id,)
+    ).fetchall()
+    return [{"role": r["role"], "content": r["content"]} for r in rows]
+
+
+def get_messages_page(session_id, limit, before=None):
+    """
+    Return up to `limit` messages of a session ending just before message id
+    `before` (or the newest ones if None), oldest first.
+
+    Returns (messages, cursor). Pass cursor as `before` to get the previous
+    page; it is None when there are no earlier messages.
+    """
+    sql = "SELECT id, role, content FROM messages WHERE session_id = ?"
+    params = [session_id]
+    if before is not None:
+        sql += " AND id < ?"
+        params.append(before)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = _connect().execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    messages = [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in rows]
+    cursor = rows[0]["id"] if has_more and rows else None
+    return messages, cursor
+
+
+def list_session_index(limit=None, offset=0):
+    """
+    Return session summaries (id, title, timestamp, message_count), newest first.
+
+    Only the sessions table is read, so this stays cheap no matter how much
+    conversation text is stored.
+    """
+    sql = "SELECT id, title, timestamp, message_count FROM sessions ORDER BY timestamp DESC"
+    params = ()
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params = (limit, offset)
+    rows = _connect().execute(sql, params).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _has_fts(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    ).fetchone() is not None
+
+
+def _fts_query(text):
+    """
+    Turn user search text into an FTS5 MATCH expression.
+
+    "quoted text" is matched as a phrase, a trailing * marks a prefix
+    term, and the last word is treated as a prefix (once it is at least
+    PREFIX_MIN_LENGTH characters) so results update while typing. Terms
+    are ANDed together.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', "") + '"')
+        elif word:
+            prefix = word.endswith("*")
+            word = word.replace('"', "").rstrip("*")
+            if word:
+                terms.append('"' + word + '"' + ("*" if prefix else ""))
+    if (terms and not text.rstrip().endswith(('"', "*")) and not text.endswith(" ")
+            and len(text.split()[-1].replace('"', "")) >= PREFIX_MIN_LENGTH):
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_messages(text, limit=SEARCH_LIMIT):
+    """
+    Full-text search over all user and assistant messages.
+
+    Returns [{session_id, title, timestamp, role, snippet}, ...], best match first.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+
+    conn = _connect()
+    if _has_fts(conn):
+        rows = conn.execute(
+            "SELECT m.session_id, s.title, s.timestamp, m.role, "
+            "snippet(messages_fts, 0, '[', ']', '...', 12) AS snippet "
+            "FROM messages_fts "
+            "JOIN messages m ON m.id = messages_fts.rowid "
+            "JOIN sessions s ON s.id = m.session_id "
+            "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT m.session_id, s.title, s.timestamp, m.role, "
+            "substr(m.content, 1, 120) AS snippet "
+            "FROM messages m JOIN sessions s ON s.id = m.session_id "
+            "WHERE m.content LIKE ? ORDER BY m.id DESC LIMIT ?",
+            ("%" + text.strip().strip('"*') + "%", limit)
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def list_sessions():
+    """Return all sessions with their messages, newest first."""
+    rows = _connect().execute(
+        "SELECT id, title, timestamp FROM sessions ORDER BY timestamp DESC"
+    ).fetchall()
+    return [
+        {
+            "id": r["id"],
+            "title": r["title"],
+            "timestamp": r["timestamp"],
+            "messages": get_messages(r["id"])
+        }
+        for r in rows
+    ]
+
+
+def get_session(session_id):
+    """Return one session with its messages, or None."""
+    row = _connect().execute(
+        "SELECT id, title, timestamp FROM sessions WHERE id = ?", (session_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "timestamp": row["timestamp"],
+        "messages": get_messages(session_id)
+    }
+
+
+def session_sizes():
+    """Return [(id, timestamp, content_bytes), ...] for all sessions, newest first."""
+    rows = _connect().execute(
+        "SELECT s.id, s.timestamp, COALESCE(SUM(length(m.content)), 0) AS size "
+        "FROM sessions s LEFT JOIN messages m ON m.session_id = s.id "
+        "GROUP BY s.id ORDER BY s.timestamp DESC"
+    ).fetchall()
+    return [(r["id"], r["timestamp"], r["size"]) for r in rows]
+
+
+def compact():
+    """Merge the search index, checkpoint the WAL and VACUUM the database file."""
+    with _write_lock:
+        conn = _connect()
+        if _has_fts(conn):
+            with conn:
+                conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+
+
+def delete_session(session_id):
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        _bump_version()
+
+
+def restore_session(session_id, session):
+    """
+    Put back a session (legacy format, see import_sessions) that was moved
+    out of the store. If a session with that id was created again in the
+    meantime, e.g. by a queued answer arriving for it, the restored
+    messages are merged in ahead of its own.
+    """
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            live = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+            # Re-inserting keeps the messages in id order: restored ones first
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            messages = [
+                (session_id, m.get("role", "user"), m.get("content", ""))
+                for m in session.get("messages", [])
+            ] + [(session_id, r["role"], r["content"]) for r in live]
+            conn.execute(
+                "INSERT INTO sessions (id, title, timestamp, message_count) VALUES (?, ?, ?, ?)",
+                (session_id, session.get("title", "Untitled"), session.get("timestamp", 0),
+                 len(messages))
+            )
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", messages
+            )
+        _bump_version()
+
+
+def import_sessions(sessions):
+    """
+    Import sessions in the legacy settings.json format ({id: session}).
+
+    Sessions that already exist are skipped, so a migration interrupted
+    half-way can simply be run again.
+    """
+    with _write_lock:
+        conn = _connect()
+        with conn:
+            for session_id, session in sessions.items():
+                messages = session.get("messages", [])
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO sessions (id, title, timestamp, message_count) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, session.get("title", "Untitled"),
+                     session.get("timestamp", 0), len(messages))
+                )
+                if cur.rowcount == 0:
+                    continue
+                conn.executemany(
+                    "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                    [
+                        (session_id, m.get("role", "user"), m.get("content", ""))
+                        for m in messages
+                    ]
+                )
+        _bump_version()
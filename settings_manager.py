@@ -1,8 +1,13 @@
 import json
 import os
 import config
+import session_store
+import history_archive
+import interaction_journal
 import uuid
 import time
+import threading
+import atexit
 
 SETTINGS_FILE = "settings.json"
 
@@ -13,7 +18,6 @@ DEFAULT_SETTINGS = {
     "selected_monitor": 1,
     "voice_mode": "toggle",  # "toggle" or "push_to_talk"
     "voice_hotkey": "ctrl+shift+v",
-    "sessions": {},
     "setup_complete": False,
     # TTS Settings
     "tts_enabled": False,
@@ -21,203 +25,458 @@ DEFAULT_SETTINGS = {
     "tts_speed": 1.25,  # Speech speed multiplier (0.5 to 2.0)
     # Window size memory
     "window_width": config.WINDOW_WIDTH,
-    "window_height": config.WINDOW_HEIGHT_EXPANDED
+    "window_height": config.WINDOW_HEIGHT_EXPANDED,
+    # Connections kept open to the webhook host
+    "http_pool_size": 4,
+    # Webhook timeouts in seconds: connecting, sending the query, waiting for
+    # the first byte of the answer
+    "connect_timeout": 10,
+    "upload_timeout": 60,
+    "first_byte_timeout": 180,
+    # Two-phase upload: staging endpoint the screenshot is uploaded to while
+    # you type (empty = send it with the query). See staging_server.py
+    "staging_url": "",
+    # Screenshot encoding: "png", "jpeg" or "webp"; quality 1-100; downscale so
+    # the long edge is at most screenshot_max_edge pixels and aim for at most
+    # screenshot_max_bytes (0 = no limit)
+    "screenshot_format": "png",
+    "screenshot_quality": 85,
+    "screenshot_max_edge": 0,
+    "screenshot_max_bytes": 0,
+    # When the screen looks the same as at the last query in the chat, send
+    # "full" (the screenshot anyway), "thumbnail" (a small copy) or "marker"
+    # (no image, just screenshot_unchanged). screen_change_threshold is the
+    # fraction of the screen (0-1) that may change and still count as the same
+    "unchanged_screenshot": "thumbnail",
+    "screen_change_threshold": 0.0,
+    # Send only the changed parts of the screen (needs a workflow that puts
+    # them back together); a full screenshot is sent instead when more than
+    # delta_full_frame_ratio (0-1) of the screen changed
+    "screenshot_deltas": False,
+    "delta_full_frame_ratio": 0.3,
+    # Capture the screen when the overlay opens so submitting doesn't wait for it
+    "prewarm_screenshot": True,
+    # Send Mid/High queries to Low as well and show whichever answer is ready
+    "race_mode": False,
+    # Extra attempts for queries that fail to reach the webhook
+    "retry_attempts": 3,
+    # Queue queries while the webhook is unreachable and send them later
+    "offline_queue_enabled": True,
+    # Reuse answers to repeated questions about the same screen
+    "response_cache_enabled": True,
+    "response_cache_size": 100,
+    "response_cache_ttl": 3600,  # seconds
+    # Show the answer as it streams in (needs a streaming n8n webhook)
+    "stream_responses": True,
+    # History retention (0 = no limit); older sessions move to history_archive/
+    "history_max_age_days": 0,
+    "history_max_sessions": 0,
+    "history_max_bytes": 0
 }
 
-def load_settings():
+# Schema migrations. Each step runs once on the stored settings (before
+# defaults are merged) and the file records the version it reached, so
+# later loads skip straight to merging defaults.
+def _migrate_setup_complete(settings):
+    # Existing users who have settings already should not see first-run
+    settings.setdefault("setup_complete", True)
+
+def _migrate_sessions_to_store(settings):
+    # Chat history now lives in session_store
+    if "sessions" in settings:
+        session_store.import_sessions(settings.pop("sessions"))
+
+MIGRATIONS = [
+    (1, _migrate_setup_complete),
+    (2, _migrate_sessions_to_store),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _run_migrations(settings):
+    """Apply pending migrations in place. Returns True if any ran."""
+    version = settings.get("schema_version", 0)
+    pending = [(v, step) for v, step in MIGRATIONS if v > version]
+    for v, step in pending:
+        step(settings)
+        settings["schema_version"] = v
+    return bool(pending)
+
+# In-memory settings store. Getters read straight from _cache; the file is
+# only re-parsed when its mtime changes, and setters write back on a
+# background thread.
+#
+# _cache is copy-on-write: updates build a new dict under _lock and swap
+# it in, so readers never take the lock or touch the disk. _version is
+# bumped on every swap and lets a reload detect that it raced an update.
+_lock = threading.RLock()
+_cache = None
+_cache_mtime = None
+_version = 0
+_last_stat = 0.0
+_dirty = False
+_write_event = threading.Event()
+_write_lock = threading.Lock()
+_writer_thread = None
+
+# How often (seconds) to stat settings.json for external changes
+MTIME_CHECK_INTERVAL = 1.0
+# Updates arriving within this window are coalesced into one write
+SAVE_DEBOUNCE = 0.5
+# ...but a steady stream of updates is still written at least this often
+SAVE_MAX_DELAY = 3.0
+
+def _file_mtime():
+    try:
+        return os.stat(SETTINGS_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+def _read_settings_file():
     if not os.path.exists(SETTINGS_FILE):
-        save_settings(DEFAULT_SETTINGS)
-        return DEFAULT_SETTINGS.copy()
-    
+        settings = DEFAULT_SETTINGS.copy()
+        settings["schema_version"] = SCHEMA_VERSION
+        _write_settings_file(settings)
+        return settings
+
     try:
         with open(SETTINGS_FILE, "r") as f:
-            settings = json.load(f)
-            # Ensure keys exist
-            if "hotkey" not in settings:
-                settings["hotkey"] = config.HOTKEY
-            if "webhook_url" not in settings:
-                settings["webhook_url"] = config.WEBHOOK_URL
-            if "include_screenshot" not in settings:
-                settings["include_screenshot"] = True
-            if "selected_monitor" not in settings:
-                settings["selected_monitor"] = 1
-            if "voice_mode" not in settings:
-                settings["voice_mode"] = "toggle"
-            if "voice_hotkey" not in settings:
-                settings["voice_hotkey"] = "ctrl+shift+v"
-            if "sessions" not in settings:
-                settings["sessions"] = {}
-            if "setup_complete" not in settings:
-                # Existing users who have settings already should not see first-run
-                settings["setup_complete"] = True
-                save_settings(settings)
-            # TTS settings
-            if "tts_enabled" not in settings:
-                settings["tts_enabled"] = False
-            if "tts_voice" not in settings:
-                settings["tts_voice"] = "jenny"
-            if "tts_speed" not in settings:
-                settings["tts_speed"] = 1.25
-            # Window size settings
-            if "window_width" not in settings:
-                settings["window_width"] = config.WINDOW_WIDTH
-            if "window_height" not in settings:
-                settings["window_height"] = config.WINDOW_HEIGHT_EXPANDED
-            return settings
+            stored = json.load(f)
     except Exception as e:
         print(f"Error loading settings: {e}")
-        return DEFAULT_SETTINGS
+        return DEFAULT_SETTINGS.copy()
 
-def save_settings(settings):
+    migrated = _run_migrations(stored)
+    # Missing keys fall back to defaults in one pass
+    settings = {**DEFAULT_SETTINGS, **stored}
+    if migrated:
+        _write_settings_file(settings)
+    return settings
+
+def _write_settings_file(settings):
+    """Atomically replace settings.json (temp file + fsync + rename)."""
+    tmp_path = SETTINGS_FILE + ".tmp"
     try:
-        with open(SETTINGS_FILE, "w") as f:
+        with open(tmp_path, "w") as f:
             json.dump(settings, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, SETTINGS_FILE)
+        return True
     except Exception as e:
         print(f"Error saving settings: {e}")
+        return False
+
+def _settings():
+    """Return the cached settings dict, reloading it if the file changed on disk."""
+    global _last_stat
+    cache = _cache
+    now = time.monotonic()
+    if cache is not None and now - _last_stat < MTIME_CHECK_INTERVAL:
+        return cache
+
+    if cache is None:
+        with _lock:
+            if _cache is None:
+                _swap(_read_settings_file(), _file_mtime())
+            return _cache
+
+    _last_stat = now
+    mtime = _file_mtime()
+    # Never clobber unsaved in-memory changes with the on-disk copy
+    if mtime != _cache_mtime and not _dirty:
+        version = _version
+        loaded = _read_settings_file()
+        with _lock:
+            if _version == version and not _dirty:
+                _swap(loaded, mtime)
+    return _cache
+
+def _swap(settings, mtime=None):
+    """Install a new settings dict. Caller must hold _lock."""
+    global _cache, _cache_mtime, _version
+    _cache = settings
+    if mtime is not None:
+        _cache_mtime = mtime
+    _version += 1
+
+def get_version():
+    """Monotonic counter that changes whenever the in-memory settings change."""
+    return _version
+
+def _writer_loop():
+    while True:
+        _write_event.wait()
+        # Coalesce bursts (window drags, several setters in a row) into one write
+        deadline = time.monotonic() + SAVE_MAX_DELAY
+        while True:
+            _write_event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not _write_event.wait(min(SAVE_DEBOUNCE, remaining)):
+                break
+        flush()
+
+def _mark_dirty():
+    """Schedule the in-memory settings to be written back to disk."""
+    global _dirty, _writer_thread
+    with _lock:
+        _dirty = True
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+            _writer_thread.start()
+    _write_event.set()
+
+def flush():
+    """Write pending settings changes to disk now (call before exiting)."""
+    global _dirty, _cache_mtime
+    # _write_lock keeps concurrent flushes from landing on disk out of order
+    with _write_lock:
+        with _lock:
+            if not _dirty or _cache is None:
+                return
+            # _cache is never mutated in place, so it can be written as-is
+            snapshot = _cache
+            _dirty = False
+
+        if not _write_settings_file(snapshot):
+            with _lock:
+                _dirty = True
+            return
+
+        with _lock:
+            _cache_mtime = _file_mtime()
+
+atexit.register(flush)
+
+def _get(key, default=None):
+    return _settings().get(key, default)
+
+def _set(**values):
+    update_settings(lambda settings: settings.update(values))
+
+def update_settings(func):
+    """
+    Atomically apply func(settings) to a copy of the settings and install it.
+
+    Concurrent callers are serialised, so read-modify-write updates from
+    different threads never overwrite each other. Returns the new version.
+    """
+    with _lock:
+        settings = dict(_settings())
+        func(settings)
+        _swap(settings)
+        _mark_dirty()
+        return _version
+
+def load_settings():
+    """Return a snapshot copy of the current settings."""
+    return dict(_settings())
+
+def save_settings(settings):
+    """Replace the in-memory settings and write them back in the background."""
+    with _lock:
+        _swap(dict(settings))
+        _mark_dirty()
 
 def create_session():
     session_id = str(uuid.uuid4())
-    settings = load_settings()
-    settings["sessions"][session_id] = {
-        "id": session_id,
-        "title": "New Chat",
-        "timestamp": time.time(),
-        "messages": []
-    }
-    save_settings(settings)
+    session_store.create_session(session_id)
     return session_id
 
 def save_interaction(session_id, query, response):
-    settings = load_settings()
-    if session_id not in settings["sessions"]:
-        # Should not happen if flow is correct, but safe fallback
-        settings["sessions"][session_id] = {
-            "id": session_id,
-            "title": query[:30] + "...",
-            "timestamp": time.time(),
-            "messages": []
-        }
-    
-    session = settings["sessions"][session_id]
-    
-    # Update title if it's the first real message
-    if len(session["messages"]) == 0 or session["title"] == "New Chat":
-        session["title"] = query[:30] + "..."
-        
-    session["messages"].append({"role": "user", "content": query})
-    session["messages"].append({"role": "assistant", "content": response})
-    session["timestamp"] = time.time() # Update timestamp to move to top
-    
-    save_settings(settings)
+    session_store.append_interaction(session_id, query, response)
+
+# Journaled interactions: the query is made durable when submitted and the
+# session store is updated from the journal in batches.
+def begin_interaction(session_id, query):
+    """Journal a submitted query. Returns an id for complete_interaction."""
+    return interaction_journal.record_query(session_id, query)
+
+def complete_interaction(entry_id, response):
+    interaction_journal.record_response(entry_id, response)
+
+def abandon_interaction(entry_id):
+    interaction_journal.discard(entry_id)
+
+def recover_interactions():
+    """Save interactions left in the journal by a previous run (call at startup)."""
+    try:
+        return interaction_journal.recover()
+    except Exception as e:
+        print(f"Error recovering interaction journal: {e}")
+        return 0
 
 def get_sessions():
-    settings = load_settings()
-    sessions = list(settings["sessions"].values())
-    # Sort by timestamp descending
-    sessions.sort(key=lambda x: x.get("timestamp", 0), reverse=True)
-    return sessions
+    interaction_journal.apply()
+    return session_store.list_sessions()
+
+def get_session_index(limit=None, offset=0):
+    """Session summaries for the History window (no message bodies)."""
+    interaction_journal.apply()
+    return session_store.list_session_index(limit, offset)
+
+def search_history(text, include_archive=False):
+    """Full-text search over all saved messages (optionally archived ones too)."""
+    interaction_journal.apply()
+    results = session_store.search_messages(text)
+    if include_archive:
+        results += history_archive.search_archive(text)
+    return results
+
+def restore_archived_session(session_id):
+    return history_archive.restore_session(session_id)
+
+def apply_history_retention():
+    """Archive sessions outside the configured retention limits."""
+    settings = _settings()
+    return history_archive.apply_retention(
+        settings.get("history_max_age_days", 0),
+        settings.get("history_max_sessions", 0),
+        settings.get("history_max_bytes", 0)
+    )
 
 def delete_session(session_id):
-    settings = load_settings()
-    if session_id in settings["sessions"]:
-        del settings["sessions"][session_id]
-        save_settings(settings)
+    session_store.delete_session(session_id)
 
 def get_session_messages(session_id):
-    settings = load_settings()
-    return settings["sessions"].get(session_id, {}).get("messages", [])
+    interaction_journal.apply()
+    return session_store.get_messages(session_id)
+
+def get_session_messages_page(session_id, limit=None, before=None):
+    """Latest messages of a session (or those before cursor). Returns (messages, cursor)."""
+    interaction_journal.apply()
+    limit = limit or config.CHAT_PAGE_TURNS * 2
+    return session_store.get_messages_page(session_id, limit, before)
 
 def get_hotkey():
-    return load_settings().get("hotkey", config.HOTKEY)
+    return _get("hotkey", config.HOTKEY)
 
 def set_hotkey(hotkey):
-    settings = load_settings()
-    settings["hotkey"] = hotkey
-    save_settings(settings)
+    _set(hotkey=hotkey)
 
 def get_webhook_url():
-    return load_settings().get("webhook_url", config.WEBHOOK_URL)
+    return _get("webhook_url", config.WEBHOOK_URL)
 
 def set_webhook_url(url):
-    settings = load_settings()
-    settings["webhook_url"] = url
-    save_settings(settings)
+    _set(webhook_url=url)
+
+def get_http_pool_size():
+    return _get("http_pool_size", 4)
+
+def get_http_timeouts():
+    settings = _settings()
+    return {
+        "connect": settings.get("connect_timeout", 10),
+        "upload": settings.get("upload_timeout", 60),
+        "first_byte": settings.get("first_byte_timeout", 180),
+    }
+
+def get_race_mode():
+    return _get("race_mode", False)
+
+def set_race_mode(enabled):
+    _set(race_mode=enabled)
+
+def get_staging_url():
+    return _get("staging_url", "")
+
+def get_prewarm_screenshot():
+    return _get("prewarm_screenshot", True)
+
+def get_screenshot_encoding():
+    """Options for screenshot_utils.encode_image."""
+    settings = _settings()
+    return {
+        "image_format": settings.get("screenshot_format", "png"),
+        "quality": settings.get("screenshot_quality", 85),
+        "max_edge": settings.get("screenshot_max_edge", 0),
+        "max_bytes": settings.get("screenshot_max_bytes", 0),
+    }
+
+def get_unchanged_screenshot():
+    return _get("unchanged_screenshot", "thumbnail")
+
+def get_screen_change_threshold():
+    return _get("screen_change_threshold", 0.0)
+
+def get_screenshot_deltas():
+    return _get("screenshot_deltas", False)
+
+def get_delta_full_frame_ratio():
+    return _get("delta_full_frame_ratio", 0.3)
+
+def get_retry_attempts():
+    return _get("retry_attempts", 3)
+
+def get_response_cache_settings():
+    settings = _settings()
+    return {
+        "enabled": settings.get("response_cache_enabled", True),
+        "size": settings.get("response_cache_size", 100),
+        "ttl": settings.get("response_cache_ttl", 3600),
+    }
+
+def get_offline_queue_enabled():
+    return _get("offline_queue_enabled", True)
+
+def get_stream_responses():
+    return _get("stream_responses", True)
 
 def get_include_screenshot():
-    return load_settings().get("include_screenshot", True)
+    return _get("include_screenshot", True)
 
 def set_include_screenshot(value):
-    settings = load_settings()
-    settings["include_screenshot"] = value
-    save_settings(settings)
+    _set(include_screenshot=value)
 
 def get_voice_mode():
-    return load_settings().get("voice_mode", "toggle")
+    return _get("voice_mode", "toggle")
 
 def set_voice_mode(mode):
-    settings = load_settings()
-    settings["voice_mode"] = mode
-    save_settings(settings)
+    _set(voice_mode=mode)
 
 def get_voice_hotkey():
-    return load_settings().get("voice_hotkey", "ctrl+shift+v")
+    return _get("voice_hotkey", "ctrl+shift+v")
 
 def set_voice_hotkey(hotkey):
-    settings = load_settings()
-    settings["voice_hotkey"] = hotkey
-    save_settings(settings)
+    _set(voice_hotkey=hotkey)
 
 def get_selected_monitor():
-    return load_settings().get("selected_monitor", 1)
+    return _get("selected_monitor", 1)
 
 def set_selected_monitor(monitor):
-    settings = load_settings()
-    settings["selected_monitor"] = monitor
-    save_settings(settings)
+    _set(selected_monitor=monitor)
 
 def is_first_run():
     """Check if this is the first time running the app."""
-    return not load_settings().get("setup_complete", False)
+    return not _get("setup_complete", False)
 
 def set_setup_complete(complete=True):
     """Mark initial setup as complete."""
-    settings = load_settings()
-    settings["setup_complete"] = complete
-    save_settings(settings)
+    _set(setup_complete=complete)
 
 # TTS Settings
 def get_tts_enabled():
-    return load_settings().get("tts_enabled", False)
+    return _get("tts_enabled", False)
 
 def set_tts_enabled(enabled):
-    settings = load_settings()
-    settings["tts_enabled"] = enabled
-    save_settings(settings)
+    _set(tts_enabled=enabled)
 
 def get_tts_voice():
-    return load_settings().get("tts_voice", "jenny")
+    return _get("tts_voice", "jenny")
 
 def set_tts_voice(voice):
-    settings = load_settings()
-    settings["tts_voice"] = voice
-    save_settings(settings)
+    _set(tts_voice=voice)
 
 def get_tts_speed():
-    return load_settings().get("tts_speed", 1.25)
+    return _get("tts_speed", 1.25)
 
 def set_tts_speed(speed):
-    settings = load_settings()
-    settings["tts_speed"] = speed
-    save_settings(settings)
+    _set(tts_speed=speed)
 
 # Window size settings
 def get_window_size():
-    settings = load_settings()
+    settings = _settings()
     return (settings.get("window_width", config.WINDOW_WIDTH),
             settings.get("window_height", config.WINDOW_HEIGHT_EXPANDED))
 
 def set_window_size(width, height):
-    settings = load_settings()
-    settings["window_width"] = width
-    settings["window_height"] = height
-    save_settings(settings)
+    _set(window_width=width, window_height=height)
@@ -0,0 +1,164 @@
+"""
+Local stand-in for the screenshot staging endpoint and the n8n webhook.
+
+Two-phase upload sends the screenshot to a staging endpoint while the user
+is typing; the query then carries only the returned handle. This server
+implements that API so the flow can be tried without n8n:
+
+    POST /stage            multipart "screenshot" -> {"handle": "..."}
+    GET  /stage/<handle>   the staged image (what a webhook would fetch)
+    POST /webhook          a fake webhook that answers with what it received;
+                           an unknown or expired screenshot_handle gets 410
+
+Usage:
+    python staging_server.py [PORT]
+
+then set in settings.json:
+    "staging_url": "http://127.0.0.1:PORT/stage",
+    "webhook_url": "http://127.0.0.1:PORT/webhook"   (optional)
+"""
+
+import email.parser
+import email.policy
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+DEFAULT_PORT = 5679
+
+# Staged screenshots are dropped after this many seconds
+STAGING_TTL = 600
+
+_lock = threading.Lock()
+_staged = {}  # handle -> ((image bytes, content type), staged at)
+
+
+def _parse_form(content_type, body):
+    """Return ({field: value}, {field: (bytes, content type)}) from a POST body."""
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is not None:
+                files[name] = (part.get_payload(decode=True), part.get_content_type())
+            else:
+                fields[name] = part.get_payload(decode=True).decode("utf-8")
+        return fields, files
+    fields = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+    return fields, {}
+
+
+def stage(image):
+    handle = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        for key in [k for k, (_, ts) in _staged.items() if now - ts > STAGING_TTL]:
+            del _staged[key]
+        _staged[handle] = (image, now)
+    return handle
+
+
+def get_staged(handle):
+    with _lock:
+        entry = _staged.get(handle)
+    if entry is None or time.time() - entry[1] > STAGING_TTL:
+        return None
+    return entry[0]
+
+
+class StagingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return _parse_form(self.headers.get("Content-Type", ""), self.rfile.read(length))
+
+    def do_HEAD(self):
+        # Used by the client to pre-warm its connection
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.startswith("/stage/"):
+            image = get_staged(self.path[len("/stage/"):])
+            if image is None:
+                self._send(404, {"error": "unknown or expired handle"})
+            else:
+                self._send(200, *image)
+            return
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            fields, files = self._read_form()
+        except Exception as e:
+            self._send(400, {"error": f"bad form data: {e}"})
+            return
+
+        if self.path == "/stage":
+            image = files.get("screenshot")
+            if not image or not image[0]:
+                self._send(400, {"error": "missing screenshot"})
+                return
+            self._send(200, {"handle": stage(image)})
+        elif self.path == "/webhook":
+            handle = fields.get("screenshot_handle")
+            if handle:
+                image = get_staged(handle)
+                if image is None:
+                    self._send(410, {"error": "unknown or expired screenshot_handle"})
+                    return
+                source = f"staged screenshot {handle[:8]}"
+            elif fields.get("screenshot_regions"):
+                regions = [f for name, f in files.items() if name.startswith("region_")]
+                image = (b"".join(part for part, _ in regions), regions[0][1]) if regions else None
+                source = f"{len(regions)} changed screen region(s)"
+            else:
+                image = files.get("screenshot")
+                source = "inline screenshot" if image else "no screenshot"
+            size = f" ({image[1]}, {len(image[0])} bytes)" if image else ""
+            if fields.get("screenshot_unchanged"):
+                size += ", screen unchanged"
+            self._send(200, {
+                "output": f"Stand-in webhook received \"{fields.get('query', '')}\" "
+                          f"[{fields.get('complexity', '')}] with {source}{size}."
+            })
+        else:
+            self._send(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        print(f"[staging] {self.address_string()} {format % args}")
+
+
+def main(argv):
+    port = int(argv[0]) if argv else DEFAULT_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), StagingHandler)
+    print(f"Staging endpoint: http://127.0.0.1:{port}/stage")
+    print(f"Stand-in webhook: http://127.0.0.1:{port}/webhook")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -5,7 +5,8 @@ Text-to-Speech utilities using Edge TTS (Microsoft neural voices).
 import threading
 import tempfile
 import os
-import asyncio
+
+import event_loop
 
 # Edge TTS (Microsoft neural voices - free, high quality)
 EDGE_TTS_AVAILABLE = False
@@ -114,10 +115,7 @@ class TTSPlayer:
             await communicate.save(temp_path)
 
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(generate())
-            loop.close()
+            event_loop.run(generate())
         except Exception as e:
             raise RuntimeError(f"Edge TTS generation failed: {e}")
 
@@ -142,11 +140,8 @@ class TTSPlayer:
                 if self.stop_requested:
                     break
 
-        # Run the async streaming
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(stream_audio())
-        loop.close()
+        # Run the async streaming on the shared event loop
+        event_loop.run(stream_audio())
 
         if self.stop_requested or not audio_chunks:
             return
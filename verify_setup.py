@@ -1,7 +1,7 @@
 import screenshot_utils
 import n8n_client
 import config
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 
 def test_screenshot():
@@ -19,13 +19,15 @@ def test_screenshot():
 
 def test_n8n_client_mock():
     print("\nTesting n8n client (Mocked)...")
-    with patch('requests.post') as mock_post:
+    with patch('aiohttp.ClientSession._request', new_callable=AsyncMock) as mock_request:
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {'output': 'This is a mocked response from n8n.'}
-        mock_post.return_value = mock_response
+        mock_response.status = 200
+        mock_response.headers = {"Content-Type": "application/json"}
+        mock_response.content.__aiter__.return_value = [b'{"output": "This is a mocked response from n8n."}']
+        mock_response.__aenter__.return_value = mock_response
+        mock_request.return_value = mock_response
         
-        response = n8n_client.send_query("Test query", b"fake_image_data")
+        response = n8n_client.send_query("Test query", b"fake_image_data", use_cache=False)
         
         if response == 'This is a mocked response from n8n.':
             print("n8n client logic verified (Mocked).")